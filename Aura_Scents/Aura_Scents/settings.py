@@ -77,6 +77,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
     'allauth.account.middleware.AccountMiddleware',
+    'store.middleware.GuestCartMiddleware',
 
     
     
@@ -124,6 +125,29 @@ DATABASES = {
 }
 
 
+# Cache
+# Version counters, render locks and cart counts kept here are shared by
+# every worker process, so the cache must not be per-process. Redis is used
+# when REDIS_URL is set, otherwise the database cache table (create it with
+# `python manage.py createcachetable`).
+
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BackOfficeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'back_office'
+
+    def ready(self):
+        from . import checks, signals
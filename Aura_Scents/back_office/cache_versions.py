@@ -0,0 +1,47 @@
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+
+
+# Shared version counters used to invalidate per-worker in-memory indexes
+OFFER_SCHEDULE_VERSION_KEY = 'offer_schedule_version'
+SEARCH_INDEX_VERSION_KEY = 'search_index_version'
+CATALOG_VERSION_KEY = 'catalog_version'
+LISTING_VERSION_KEY = 'listing_version'
+
+# Seconds a worker reuses a version it has read before asking the cache again
+VERSION_CHECK_INTERVAL = 1.0
+
+# key -> (version, time.monotonic() when read) for this worker
+_checked = {}
+
+
+def get_version(key):
+    """
+    Return the shared version stored under key, creating it if missing. The
+    cache is asked at most once per VERSION_CHECK_INTERVAL per worker, as a
+    database cache turns every read into a query.
+    """
+    now = time.monotonic()
+    checked = _checked.get(key)
+    if checked is not None and now - checked[1] < VERSION_CHECK_INTERVAL:
+        return checked[0]
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, timeout=None)
+        version = cache.get(key)
+    _checked[key] = (version, now)
+    return version
+
+
+def bump_version(key):
+    """
+    Invalidate everything built against the current version of key. A new
+    random version rather than incr(), which is a read and a write on the
+    database cache, so concurrent bumps can never land on a value already seen.
+    """
+    version = uuid4().hex
+    cache.set(key, version, timeout=None)
+    # The worker that made the change sees it straight away
+    _checked[key] = (version, time.monotonic())
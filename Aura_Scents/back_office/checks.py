@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+# Backends that keep a separate cache in every process
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Version counters and render locks only work if every worker sees the same cache"""
+    if settings.CACHES['default']['BACKEND'] in PER_PROCESS_CACHES:
+        return [Error(
+            'The default cache is not shared between worker processes.',
+            hint='Set REDIS_URL or use the database cache, as in the project settings.',
+            id='back_office.E001',
+        )]
+    return []
@@ -3,9 +3,10 @@ from django import forms
 from django.contrib.auth.forms import AuthenticationForm
 
 from django import forms
-from .models import Product,Category, ProductImage,Coupon,Offer,ProductOffer,CategoryOffer
+from .models import Product,Category, ProductImage,Coupon,CouponCampaign,Offer,ProductOffer,CategoryOffer
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import InMemoryUploadedFile
+import re
 
 
 
@@ -43,6 +44,30 @@ class CouponForm(forms.ModelForm):
             self.add_error('max_discount_amount', "Maximum discount amount must be positive.")
 
         return cleaned_data
+
+
+class CouponCampaignForm(forms.ModelForm):
+    # Codes generated when the campaign is created
+    quantity = forms.IntegerField(min_value=1, max_value=100000, help_text="Number of codes to generate")
+
+    class Meta:
+        model = CouponCampaign
+        fields = [
+            'name', 'description', 'code_prefix', 'coupon_type', 'discount_value',
+            'minimum_order_amount', 'max_discount_amount', 'valid_from',
+            'valid_until', 'usage_limit'
+        ]
+        widgets = {
+            'valid_from': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+            'valid_until': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+            'description': forms.Textarea(attrs={'rows': 4}),
+        }
+
+    def clean_code_prefix(self):
+        code_prefix = self.cleaned_data['code_prefix'].strip().upper()
+        if not re.match(r'^[A-Z0-9]*$', code_prefix):
+            raise ValidationError("Code prefix must be letters and digits only.")
+        return code_prefix
     
 
 class OfferForm(forms.ModelForm):
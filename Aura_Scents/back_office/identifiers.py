@@ -0,0 +1,117 @@
+import os
+import secrets
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+# Crockford's base32: digits and capitals without I, L, O or U, so codes read back unambiguously
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_LENGTH = 7
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+# Length of random codes; 32**10 is about 10**15, so valid codes cannot be guessed
+SECRET_CODE_LENGTH = 10
+
+# Odd, so multiplying by it permutes the code space and consecutive numbers get unrelated codes
+SCRAMBLE = 0x5DEECE66D
+
+# Numbers handed out per IdBlock row
+BLOCK_SIZE = 1000
+
+# Alias of the private connection that commits block claims
+CLAIM_ALIAS = 'identifier_claims'
+
+
+def encode(number):
+    """Fixed-width code for a number below CODE_SPACE; distinct numbers give distinct codes"""
+    if not 0 <= number < CODE_SPACE:
+        raise OverflowError('Identifier space exhausted')
+    number = number * SCRAMBLE % CODE_SPACE
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+class IdentifierAllocator:
+    """
+    Hands out unique numbers from blocks claimed by inserting an IdBlock
+    row, so there is one database round trip per BLOCK_SIZE identifiers
+    and none per identifier. A claim is committed before its block is
+    reused: inside a transaction it goes through a connection of its own,
+    so rolling the caller back cannot free a block this process still
+    hands out. SQLite has a single writer, which may be the caller, so
+    there the claim joins the caller's transaction and the block serves
+    only the take() that claimed it until that transaction commits. A
+    forked process claims its own block rather than sharing its parent's.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = self._end = 0
+        self._pending = False
+
+    def _insert_block(self):
+        from .models import IdBlock
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        if not connection.in_atomic_block:
+            return IdBlock.objects.create().pk
+        if connection.vendor == 'sqlite':
+            self._pending = True
+            block = IdBlock.objects.create().pk
+            transaction.on_commit(lambda: self._confirm(block))
+            return block
+
+        connections[CLAIM_ALIAS] = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            return IdBlock.objects.using(CLAIM_ALIAS).create().pk
+        finally:
+            connections[CLAIM_ALIAS].close()
+            del connections[CLAIM_ALIAS]
+
+    def _confirm(self, block):
+        """The transaction that claimed block committed, so later takes may use it"""
+        with self._lock:
+            if self._end == (block + 1) * self.block_size:
+                self._pending = False
+
+    def _claim_block(self):
+        self._pending = False
+        block = self._insert_block()
+        self._pid = os.getpid()
+        self._next, self._end = block * self.block_size, (block + 1) * self.block_size
+
+    def take(self, count=1):
+        """count unique numbers, claiming further blocks as needed"""
+        numbers = []
+        with self._lock:
+            while len(numbers) < count:
+                if self._pending or self._pid != os.getpid() or self._next >= self._end:
+                    self._claim_block()
+                taken = min(count - len(numbers), self._end - self._next)
+                numbers.extend(range(self._next, self._next + taken))
+                self._next += taken
+        return numbers
+
+
+def secret_code(length=SECRET_CODE_LENGTH):
+    """
+    Random code over the same alphabet, for codes that grant something to
+    whoever holds them. encode() is an invertible permutation, so its codes
+    are unique but one of them reveals the rest; callers must still check
+    these for collisions.
+    """
+    return ''.join(secrets.choice(ALPHABET) for _ in range(length))
+
+
+allocator = IdentifierAllocator()
+
+
+def next_code():
+    """A short unique code such as '3QZ7K0M', shared by order IDs, referral and coupon codes"""
+    return encode(allocator.take()[0])
@@ -0,0 +1,54 @@
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MediaBlob, Product, ProductImage
+from .product_cards import refresh_product_cards
+
+
+# Seconds after which a claimed image is assumed abandoned by a dead worker
+CLAIM_TIMEOUT = 600
+
+
+def claim_images(limit):
+    """Mark up to limit pending (or abandoned) images as processing; returns [(id, name)]"""
+    now = timezone.now()
+    abandoned = now - timezone.timedelta(seconds=CLAIM_TIMEOUT)
+    with transaction.atomic():
+        claimable = ProductImage.objects.select_for_update(
+            skip_locked=connection.features.has_select_for_update_skip_locked
+        ).filter(
+            Q(status='pending') | Q(status='processing', claimed_at__lt=abandoned)
+        ).order_by('id')
+        claimed = list(claimable.values_list('id', 'image')[:limit])
+        ProductImage.objects.filter(id__in=[image_id for image_id, _ in claimed]).update(
+            status='processing',
+            claimed_at=now
+        )
+    return claimed
+
+
+def finish_images(ready_ids, failed_ids, widths=None):
+    """
+    Record processing results and show newly ready covers on product cards.
+    widths maps image names to the {size: width} of their derivatives.
+    """
+    with transaction.atomic():
+        for name, sizes in (widths or {}).items():
+            MediaBlob.objects.filter(name=name).update(derivative_widths=sizes)
+        if failed_ids:
+            ProductImage.objects.filter(id__in=failed_ids).update(status='failed', claimed_at=None)
+        if ready_ids:
+            ProductImage.objects.filter(id__in=ready_ids).update(status='ready', claimed_at=None)
+            # Later uploads of the same content reuse these derivatives
+            MediaBlob.objects.filter(
+                name__in=ProductImage.objects.filter(id__in=ready_ids).values('image')
+            ).update(derivatives_ready=True)
+            refresh_product_cards(
+                Product.objects.filter(cover_image_id__in=ready_ids).values_list('id', flat=True)
+            )
+
+
+def retry_failed_images():
+    """Queue failed images again; returns the number requeued"""
+    return ProductImage.objects.filter(status='failed').update(status='pending')
@@ -0,0 +1,112 @@
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+
+# Derivative name -> longest edge in pixels; override with PRODUCT_IMAGE_SIZES
+IMAGE_SIZES = getattr(settings, 'PRODUCT_IMAGE_SIZES', {
+    'thumb': 160,
+    'card': 320,
+    'detail': 600,
+    'zoom': 1200,
+})
+
+# (extension, Pillow format, save options); WebP first, JPEG as the fallback
+DERIVATIVE_FORMATS = [
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+]
+
+DERIVATIVE_ROOT = 'derivatives'
+
+
+def derivative_name(name, size, extension):
+    """Storage path of one derivative; depends only on the original's name"""
+    stem = os.path.splitext(name)[0]
+    return os.path.join(DERIVATIVE_ROOT, stem, f'{size}.{extension}')
+
+
+def derivative_url(name, size, extension='jpg'):
+    return default_storage.url(derivative_name(name, size, extension))
+
+
+def derivative_names(name):
+    return [
+        derivative_name(name, size, extension)
+        for size in IMAGE_SIZES
+        for extension, _, _ in DERIVATIVE_FORMATS
+    ]
+
+
+def has_derivatives(name):
+    return all(default_storage.exists(path) for path in derivative_names(name))
+
+
+def _open_rgb(name):
+    with default_storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        image.load()
+    # Respect camera orientation, then flatten transparency onto white for JPEG
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_derivatives(name):
+    """
+    Write every configured size of the image stored at name in WebP and JPEG.
+    Only touches storage, so it can run in a separate process. Returns
+    {size: width} of what was written; images are never upscaled and are
+    fitted by their longest edge, so widths often differ from IMAGE_SIZES.
+    """
+    image = _open_rgb(name)
+    widths = {}
+    # Largest first, so each size is downscaled from the previous one
+    for size, edge in sorted(IMAGE_SIZES.items(), key=lambda item: -item[1]):
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        widths[size] = image.width
+        for extension, image_format, options in DERIVATIVE_FORMATS:
+            buffer = io.BytesIO()
+            image.save(buffer, image_format, **options)
+            path = derivative_name(name, size, extension)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            default_storage.save(path, ContentFile(buffer.getvalue()))
+    return widths
+
+
+def read_derivative_widths(name):
+    """{size: width} of derivatives already in storage; reads only the JPEG headers"""
+    widths = {}
+    for size in IMAGE_SIZES:
+        with default_storage.open(derivative_name(name, size, 'jpg'), 'rb') as derivative:
+            widths[size] = Image.open(derivative).width
+    return widths
+
+
+def delete_derivatives(name):
+    for path in derivative_names(name):
+        if default_storage.exists(path):
+            default_storage.delete(path)
+
+
+def derivative_pool(workers):
+    """
+    Process pool for generating derivatives. Workers are spawned rather than
+    forked, so they set Django up afresh and never share the parent's
+    database connections, whatever the platform's default start method.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+    )
@@ -0,0 +1,85 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from back_office.models import Category, Product
+from back_office.search import rebuild_search_index, search_paginator
+
+
+BENCHMARK_CATEGORY = 'Search Benchmark'
+
+NOTES = [
+    'rose', 'jasmine', 'oud', 'amber', 'musk', 'vanilla', 'sandalwood', 'citrus',
+    'bergamot', 'lavender', 'patchouli', 'vetiver', 'neroli', 'cedar', 'iris',
+    'tuberose', 'saffron', 'leather', 'tonka', 'peony', 'fig', 'incense', 'ylang',
+]
+
+# Filler vocabulary so descriptions look like real copy rather than a list of notes
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'vor', 'sel', 'du', 'phi', 'nax', 'or', 'bel']
+FILLER = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+
+class Command(BaseCommand):
+    help = "Compare the search index against the icontains search on a synthetic catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000, help="Synthetic products to create")
+        parser.add_argument('--repeat', type=int, default=20, help="Runs per query")
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic catalog afterwards")
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        category, _ = Category.objects.get_or_create(name=BENCHMARK_CATEGORY, defaults={'is_blocked': True})
+
+        self.stdout.write(f"Creating {options['products']} synthetic products...")
+        Product.objects.bulk_create([
+            Product(
+                category=category,
+                name=' '.join(rng.sample(NOTES, 2)).title(),
+                description=' '.join(
+                    rng.choice(NOTES) if rng.random() < 0.05 else rng.choice(FILLER)
+                    for _ in range(80)
+                ),
+                price=Decimal(rng.randint(100, 5000)),
+                stock=10,
+            )
+            for _ in range(options['products'])
+        ], batch_size=1000)
+        rebuild_search_index()
+
+        try:
+            base = Product.objects.filter(category=category)
+            queries = ['rose', 'oud amber', 'sandal', 'vanilla musk tonka']
+            self.stdout.write(f"{'query':<22}{'icontains ms':>14}{'index ms':>12}")
+            for query in queries:
+                # A count plus the first page, as the old products_page did;
+                # the index side only pages, since its total is cached
+                icontains_ms = self._time(
+                    lambda: self._page(base.filter(Q(name__icontains=query) | Q(description__icontains=query)).order_by('id')),
+                    options['repeat']
+                )
+                index_ms = self._time(
+                    lambda: search_paginator(base, query, ['-search_rank', 'pk'], 5).get_page(None),
+                    options['repeat']
+                )
+                self.stdout.write(f"{query:<22}{icontains_ms:>14.2f}{index_ms:>12.2f}")
+        finally:
+            if not options['keep']:
+                category.delete()
+                rebuild_search_index()
+
+    @staticmethod
+    def _page(queryset):
+        queryset.count()
+        return list(queryset.values_list('id', flat=True)[:5])
+
+    @staticmethod
+    def _time(run, repeat):
+        run()  # Warm up caches and the in-process index
+        start = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        return (time.perf_counter() - start) * 1000 / repeat
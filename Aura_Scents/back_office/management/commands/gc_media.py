@@ -0,0 +1,62 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from back_office.images import delete_derivatives
+from back_office.models import MediaBlob, ProductImage, User
+from back_office.storage import media_storage
+
+
+class Command(BaseCommand):
+    help = "Delete media files no longer referenced by any image, with their derivatives"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=24, help="Keep files released more recently than this")
+        parser.add_argument('--batch-size', type=int, default=500, help="Files checked per batch")
+        parser.add_argument('--dry-run', action='store_true', help="List orphaned files without deleting them or correcting counts")
+
+    def handle(self, *args, **options):
+        # The grace period covers uploads stored but not yet counted
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        candidates = list(
+            MediaBlob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff).values_list('name', flat=True)
+        )
+        batch_size = options['batch_size']
+
+        deleted = kept = 0
+        for start in range(0, len(candidates), batch_size):
+            batch = candidates[start:start + batch_size]
+            with transaction.atomic():
+                names = list(
+                    MediaBlob.objects.select_for_update()
+                    .filter(name__in=batch, ref_count__lte=0)
+                    .values_list('name', flat=True)
+                )
+                # Trust the rows over the counter before deleting anything
+                references = Counter(ProductImage.objects.filter(image__in=names).values_list('image', flat=True))
+                references.update(User.objects.filter(profile_image__in=names).values_list('profile_image', flat=True))
+                if not options['dry_run']:
+                    for name, count in references.items():
+                        MediaBlob.objects.filter(name=name).update(ref_count=count)
+                kept += len(references)
+
+                orphans = [name for name in names if name not in references]
+                if options['dry_run']:
+                    for name in orphans:
+                        self.stdout.write(name)
+                    deleted += len(orphans)
+                    continue
+                MediaBlob.objects.filter(name__in=orphans).delete()
+
+            for name in orphans:
+                media_storage.delete(name)
+                delete_derivatives(name)
+            deleted += len(orphans)
+
+        action = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {deleted} unreferenced files; {kept} still referenced."
+        ))
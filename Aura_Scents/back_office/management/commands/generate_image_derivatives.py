@@ -0,0 +1,57 @@
+import os
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from back_office.image_queue import finish_images
+from back_office.images import derivative_pool, generate_derivatives, has_derivatives, read_derivative_widths
+from back_office.models import ProductImage
+
+
+def _process(name, force):
+    """Worker entry point; returns (name, error message or None, skipped, {size: width})"""
+    try:
+        if not force and has_derivatives(name):
+            return name, None, True, read_derivative_widths(name)
+        return name, None, False, generate_derivatives(name)
+    except Exception as e:
+        return name, str(e), False, None
+
+
+class Command(BaseCommand):
+    help = "Generate missing WebP/JPEG derivatives for existing product images using a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+        parser.add_argument('--force', action='store_true', help="Regenerate derivatives that already exist")
+
+    def handle(self, *args, **options):
+        names = list(
+            ProductImage.objects.exclude(image='').values_list('image', flat=True).distinct()
+        )
+
+        generated = skipped = failed = 0
+        widths = {}
+        with derivative_pool(options['workers']) as executor:
+            futures = [executor.submit(_process, name, options['force']) for name in names]
+            for future in as_completed(futures):
+                name, error, was_skipped, sizes = future.result()
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{name}: {error}")
+                elif was_skipped:
+                    skipped += 1
+                    widths[name] = sizes
+                else:
+                    generated += 1
+                    widths[name] = sizes
+
+        # Images with derivatives on disk no longer need the queue
+        finish_images(
+            list(ProductImage.objects.filter(image__in=widths).exclude(status='ready').values_list('id', flat=True)),
+            [], widths
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {generated}, skipped {skipped}, failed {failed} of {len(names)} images."
+        ))
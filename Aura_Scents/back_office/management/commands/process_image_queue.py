@@ -0,0 +1,46 @@
+import os
+import time
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from back_office.image_queue import claim_images, finish_images, retry_failed_images
+from back_office.images import derivative_pool, generate_derivatives
+
+
+class Command(BaseCommand):
+    help = "Generate derivatives for uploaded product images in a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--retry-failed', action='store_true', help="Queue failed images again before starting")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if options['retry_failed']:
+            self.stdout.write(f"Requeued {retry_failed_images()} failed images.")
+
+        with derivative_pool(workers) as executor:
+            while True:
+                claimed = claim_images(workers * 2)
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                futures = {executor.submit(generate_derivatives, name): (image_id, name) for image_id, name in claimed}
+                ready_ids, failed_ids, widths = [], [], {}
+                for future in as_completed(futures):
+                    image_id, name = futures[future]
+                    try:
+                        widths[name] = future.result()
+                        ready_ids.append(image_id)
+                    except Exception as e:
+                        failed_ids.append(image_id)
+                        self.stderr.write(f"Image {image_id}: {e}")
+
+                finish_images(ready_ids, failed_ids, widths)
+                self.stdout.write(f"Processed {len(ready_ids)} images, {len(failed_ids)} failed.")
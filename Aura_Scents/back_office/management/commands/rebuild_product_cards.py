@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from back_office.product_cards import rebuild_product_cards
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product cards read by the storefront listing pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Products refreshed per batch")
+
+    def handle(self, *args, **options):
+        total = rebuild_product_cards(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} product cards."))
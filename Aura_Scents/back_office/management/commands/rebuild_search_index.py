@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from back_office.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search documents used by the storefront search"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows written per bulk insert")
+
+    def handle(self, *args, **options):
+        total = rebuild_search_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} products."))
@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-18 13:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def add_fulltext_index(apps, schema_editor):
+    # FULLTEXT indexes are MySQL-only; other backends use the in-process index
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE back_office_productsearchdocument '
+            'ADD FULLTEXT INDEX product_search_document_ft (document)'
+        )
+
+
+def build_search_documents(apps, schema_editor):
+    # Same text as search.build_document, so search works straight after deploy
+    Product = apps.get_model('back_office', 'Product')
+    ProductSearchDocument = apps.get_model('back_office', 'ProductSearchDocument')
+    batch = []
+    for product in Product.objects.select_related('category').order_by('id').iterator(chunk_size=1000):
+        document = '\n'.join([product.name, product.category.name, product.description])
+        batch.append(ProductSearchDocument(product=product, document=document))
+        if len(batch) >= 1000:
+            ProductSearchDocument.objects.bulk_create(batch)
+            batch = []
+    ProductSearchDocument.objects.bulk_create(batch)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE back_office_productsearchdocument '
+            'DROP INDEX product_search_document_ft'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0002_user_referral_code_referral'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='back_office.product')),
+                ('document', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(add_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+    ]
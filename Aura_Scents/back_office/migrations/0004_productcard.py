@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 14:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0003_productsearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='back_office.product')),
+                ('name', models.CharField(max_length=255)),
+                ('cover_image', models.CharField(blank=True, max_length=255)),
+                ('display_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('product_discount', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('category_discount', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('best_discount', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('offer_type', models.CharField(blank=True, choices=[('product', 'Product Offer'), ('category', 'Category Offer')], max_length=20)),
+                ('effective_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('in_stock', models.BooleanField(default=False)),
+                ('category_blocked', models.BooleanField(default=False)),
+                ('is_listed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('pricing_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_cards', to='back_office.category')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['is_listed', 'created_at'], name='back_office_is_list_28801e_idx'), models.Index(fields=['is_listed', 'effective_price'], name='back_office_is_list_02af1f_idx'), models.Index(fields=['category', 'is_listed'], name='back_office_categor_b1f11d_idx'), models.Index(fields=['pricing_expires_at'], name='back_office_pricing_7920db_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 14:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_cover_images(apps, schema_editor):
+    # Existing products use their first uploaded image as the cover
+    Product = apps.get_model('back_office', 'Product')
+    ProductImage = apps.get_model('back_office', 'ProductImage')
+    first_images = {}
+    for product_id, image_id in ProductImage.objects.order_by('-id').values_list('product_id', 'id'):
+        first_images[product_id] = image_id
+    for product_id, image_id in first_images.items():
+        Product.objects.filter(pk=product_id).update(cover_image_id=image_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0004_productcard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='cover_image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='back_office.productimage'),
+        ),
+        migrations.RunPython(set_cover_images, migrations.RunPython.noop),
+    ]
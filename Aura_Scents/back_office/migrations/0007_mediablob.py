@@ -0,0 +1,54 @@
+# Generated by Django 5.2 on 2026-10-18 14:14
+
+import back_office.models
+import back_office.storage
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def count_references(apps, schema_editor):
+    # Existing files keep their names; counting them lets gc_media reclaim them
+    ProductImage = apps.get_model('back_office', 'ProductImage')
+    User = apps.get_model('back_office', 'User')
+    MediaBlob = apps.get_model('back_office', 'MediaBlob')
+    counts = Counter(ProductImage.objects.exclude(image='').values_list('image', flat=True))
+    counts.update(
+        User.objects.exclude(profile_image='').exclude(profile_image__isnull=True).values_list('profile_image', flat=True)
+    )
+    ready = set(ProductImage.objects.filter(status='ready').values_list('image', flat=True))
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, ref_count=count, derivatives_ready=name in ready) for name, count in counts.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0006_productimage_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('derivatives_ready', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=back_office.storage.get_media_storage, upload_to=back_office.models.product_image_upload_path),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='profile_image',
+            field=models.ImageField(blank=True, help_text='Upload a profile image (JPG, JPEG, PNG only)', null=True, storage=back_office.storage.get_media_storage, upload_to=back_office.models.user_profile_image_path),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
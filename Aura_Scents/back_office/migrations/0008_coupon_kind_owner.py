@@ -0,0 +1,48 @@
+# Generated by Django 5.2 on 2026-10-18 14:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def classify_referral_coupons(apps, schema_editor):
+    Coupon = apps.get_model('back_office', 'Coupon')
+    Referral = apps.get_model('back_office', 'Referral')
+    for kind, coupon_field, owner_field in (
+        ('referrer_reward', 'referrer_coupon', 'referrer'),
+        ('welcome', 'referred_coupon', 'referred_user'),
+    ):
+        referrals = Referral.objects.filter(**{coupon_field: OuterRef('pk')})
+        Coupon.objects.filter(
+            pk__in=Referral.objects.exclude(**{f'{coupon_field}__isnull': True}).values(coupon_field)
+        ).update(kind=kind, owner=Subquery(referrals.values(owner_field)[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0007_mediablob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='kind',
+            field=models.CharField(choices=[('promo', 'Promo Coupon'), ('referrer_reward', 'Referral Reward Coupon'), ('welcome', 'Welcome Coupon')], default='promo', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='owned_coupons', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(classify_referral_coupons, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['kind', 'is_active', 'valid_until'], name='coupon_kind_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coupon',
+            index=models.Index(fields=['owner', 'is_active', 'valid_until'], name='coupon_owner_active_idx'),
+        ),
+    ]
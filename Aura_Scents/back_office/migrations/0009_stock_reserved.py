@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0008_coupon_kind_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productvariant',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
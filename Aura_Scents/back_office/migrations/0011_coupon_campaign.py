@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 14:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0010_idblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CouponCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('description', models.TextField(blank=True, help_text="Description given to the campaign's coupons")),
+                ('code_prefix', models.CharField(blank=True, help_text='Uppercase letters or digits starting every code (e.g., SUMMER)', max_length=8)),
+                ('coupon_type', models.CharField(choices=[('percentage', 'Percentage Discount'), ('fixed', 'Fixed Amount Discount')], default='percentage', max_length=20)),
+                ('discount_value', models.DecimalField(decimal_places=2, help_text='Discount amount or percentage', max_digits=10)),
+                ('minimum_order_amount', models.DecimalField(decimal_places=2, default=0, help_text='Minimum order amount to apply a code', max_digits=10)),
+                ('max_discount_amount', models.DecimalField(blank=True, decimal_places=2, help_text='Maximum discount cap for percentage coupons', max_digits=10, null=True)),
+                ('valid_from', models.DateTimeField(default=django.utils.timezone.now)),
+                ('valid_until', models.DateTimeField()),
+                ('usage_limit', models.PositiveIntegerField(default=1, help_text='Number of times each code can be used')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='coupon',
+            name='kind',
+            field=models.CharField(choices=[('promo', 'Promo Coupon'), ('referrer_reward', 'Referral Reward Coupon'), ('welcome', 'Welcome Coupon'), ('campaign', 'Campaign Coupon')], default='promo', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='campaign',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='coupons', to='back_office.couponcampaign'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0011_coupon_campaign'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='derivative_widths',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='productcard',
+            name='cover_widths',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
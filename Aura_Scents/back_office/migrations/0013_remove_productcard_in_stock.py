@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 15:13
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('back_office', '0012_derivative_widths'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='productcard',
+            name='in_stock',
+        ),
+    ]
@@ -1,18 +1,22 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 
 from django.utils import timezone
 from PIL import Image
+import io
 import os
 from uuid import uuid4
 
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
 from decimal import Decimal
 import re
 
-import random,string
 from django.conf import settings
 
+from .identifiers import SECRET_CODE_LENGTH, next_code, secret_code
+from .storage import get_media_storage
+
 
 def user_profile_image_path(instance, filename):
     """Generate upload path for user profile images"""
@@ -25,6 +29,7 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     profile_image = models.ImageField(
         upload_to=user_profile_image_path,
+        storage=get_media_storage,
         blank=True,
         null=True,
         help_text="Upload a profile image (JPG, JPEG, PNG only)"
@@ -38,32 +43,54 @@ class User(AbstractUser):
         return self.email
 
     def generate_referral_code(self):
-        """Generate a unique 10-character referral code"""
-        characters = string.ascii_uppercase + string.digits
-        code = ''.join(random.choice(characters) for _ in range(10))
-        
-        # Ensure uniqueness
-        while User.objects.filter(referral_code=code).exists():
-            code = ''.join(random.choice(characters) for _ in range(10))
-        return code
+        """Unique referral code from the shared identifier allocator; no lookups needed"""
+        return next_code()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored image name so save() can tell whether it changed
+        if 'profile_image' in field_names:
+            instance._stored_profile_image = values[field_names.index('profile_image')] or ''
+        return instance
+
+    def resize_profile_image(self):
+        """Shrink a new upload to 400x400 before it is stored"""
+        with Image.open(self.profile_image) as img:
+            image_format = img.format or 'JPEG'
+            if img.mode in ("RGBA", "P"):
+                img = img.convert("RGB")
+            max_size = (400, 400)
+            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, format=image_format, quality=85, optimize=True)
+        self.profile_image.save(self.profile_image.name, ContentFile(buffer.getvalue()), save=False)
 
     def save(self, *args, **kwargs):
         # Generate referral code on first save if not exists
         if not self.referral_code and not self.pk:
             self.referral_code = self.generate_referral_code()
-        
+
+        # Saves such as update_fields=['last_login'] never touch the image
+        update_fields = kwargs.get('update_fields')
+        image_tracked = (
+            (update_fields is None or 'profile_image' in update_fields)
+            and 'profile_image' not in self.get_deferred_fields()
+        )
+
+        # Resize only new uploads, before storing, so identical images share one file
+        if image_tracked and self.profile_image and not self.profile_image._committed:
+            self.resize_profile_image()
+
         super().save(*args, **kwargs)
 
-        # Resize profile image if it exists
-        if self.profile_image:
-            img_path = self.profile_image.path
-            if os.path.exists(img_path):
-                with Image.open(img_path) as img:
-                    if img.mode in ("RGBA", "P"):
-                        img = img.convert("RGB")
-                    max_size = (400, 400)
-                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                    img.save(img_path, quality=85, optimize=True)
+        if image_tracked:
+            stored = getattr(self, '_stored_profile_image', '')
+            current = self.profile_image.name or ''
+            if current != stored:
+                MediaBlob.acquire(current)
+                MediaBlob.release(stored)
+            self._stored_profile_image = current
 
 class Category(models.Model):
     name = models.CharField(max_length=255,unique=True)
@@ -89,13 +116,34 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
+    # Units held by live checkout reservations (store.StockReservation)
+    reserved = models.PositiveIntegerField(default=0, editable=False)
     is_blocked = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
+    cover_image = models.ForeignKey('ProductImage', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
 
     def __str__(self):
         return self.name
 
+    @property
+    def available_stock(self):
+        """Stock that can still be sold: stock minus live checkout reservations"""
+        return max(self.stock - self.reserved, 0)
+
+    def get_cover_image(self):
+        """Cover image, taken from select_related or prefetched images when loaded"""
+        if self.cover_image_id is None:
+            return None
+        if Product.cover_image.is_cached(self):
+            return self.cover_image
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('images')
+        if prefetched is not None:
+            for image in prefetched:
+                if image.pk == self.cover_image_id:
+                    return image
+        return self.cover_image
+
 # Units choices
 UNIT_CHOICES = [
     ('ml', 'Milliliter'),
@@ -109,6 +157,7 @@ class ProductVariant(models.Model):
     unit = models.CharField(max_length=5, choices=UNIT_CHOICES)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
+    reserved = models.PositiveIntegerField(default=0, editable=False)
     is_deleted = models.BooleanField(default=False)
     is_blocked = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -116,21 +165,90 @@ class ProductVariant(models.Model):
     class Meta:
         unique_together = ('product', 'volume', 'unit')
 
+    @property
+    def available_stock(self):
+        """Stock that can still be sold: stock minus live checkout reservations"""
+        return max(self.stock - self.reserved, 0)
+
     def __str__(self):
         return f"{self.product.name} - {self.volume} {self.unit}"
 
 
 # Product Image Model
 class ProductImage(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to=product_image_upload_path)
+    image = models.ImageField(upload_to=product_image_upload_path, storage=get_media_storage)
+    # Derivatives are generated by the process_image_queue worker; until the
+    # image is ready, pages show a placeholder
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def is_ready(self):
+        return self.status == 'ready'
 
     def save(self, *args, **kwargs):
+        if self._state.adding and self.image and not self.image._committed:
+            # Store the upload first; content processed before needs no queueing
+            self.image.save(self.image.name, self.image.file, save=False)
+            if MediaBlob.objects.filter(name=self.image.name, derivatives_ready=True).exists():
+                self.status = 'ready'
         super().save(*args, **kwargs)
-        img = Image.open(self.image.path)
-        img = img.convert("RGB")
-        img = img.resize((600, 600), Image.LANCZOS)
-        img.save(self.image.path)
+
+
+# Identifier Block Model
+class IdBlock(models.Model):
+    """A claimed block of identifiers; the auto-increment id is the block number (see identifiers.py)"""
+    claimed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Block {self.pk}"
+
+
+# Media Blob Model
+class MediaBlob(models.Model):
+    """Reference count for a file in the content-addressed media storage"""
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.IntegerField(default=0)
+    derivatives_ready = models.BooleanField(default=False)
+    # Size name -> pixel width of its derivatives, for srcset w descriptors
+    derivative_widths = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+    @classmethod
+    def acquire(cls, name):
+        if not name:
+            return
+        cls.objects.bulk_create([cls(name=name)], ignore_conflicts=True)
+        cls.objects.filter(name=name).update(ref_count=models.F('ref_count') + 1, updated_at=timezone.now())
+
+    @classmethod
+    def release(cls, name):
+        # Unreferenced files stay until gc_media removes them
+        if not name:
+            return
+        cls.objects.filter(name=name).update(ref_count=models.F('ref_count') - 1, updated_at=timezone.now())
+
+
+# Product Search Document Model
+class ProductSearchDocument(models.Model):
+    """Denormalized search text (name, category and description) for a product"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    document = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for {self.product_id}"
 
 
 # Coupon Model
@@ -140,6 +258,17 @@ class Coupon(models.Model):
         ('fixed', 'Fixed Amount Discount'),
     ]
 
+    PROMO = 'promo'
+    REFERRER_REWARD = 'referrer_reward'
+    WELCOME = 'welcome'
+    CAMPAIGN = 'campaign'
+    COUPON_KINDS = [
+        (PROMO, 'Promo Coupon'),
+        (REFERRER_REWARD, 'Referral Reward Coupon'),
+        (WELCOME, 'Welcome Coupon'),
+        (CAMPAIGN, 'Campaign Coupon'),
+    ]
+
     code = models.CharField(max_length=20, unique=True, help_text="Unique coupon code (e.g., SAVE10)")
     description = models.TextField(blank=True, help_text="Description of the coupon")
     coupon_type = models.CharField(max_length=20, choices=COUPON_TYPES, default='percentage')
@@ -151,11 +280,32 @@ class Coupon(models.Model):
     usage_limit = models.PositiveIntegerField(null=True, blank=True, help_text="Maximum number of times coupon can be used")
     usage_count = models.PositiveIntegerField(default=0, help_text="Number of times coupon has been used")
     is_active = models.BooleanField(default=True, help_text="Whether the coupon is active")
+    # Promo coupons are open to everyone and campaign coupons to whoever holds
+    # the code; the other kinds belong to their owner
+    kind = models.CharField(max_length=20, choices=COUPON_KINDS, default=PROMO)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='owned_coupons'
+    )
+    campaign = models.ForeignKey(
+        'CouponCampaign',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='coupons'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['kind', 'is_active', 'valid_until'], name='coupon_kind_active_idx'),
+            models.Index(fields=['owner', 'is_active', 'valid_until'], name='coupon_owner_active_idx'),
+        ]
 
     def __str__(self):
         return self.code
@@ -192,6 +342,28 @@ class Coupon(models.Model):
         self.full_clean()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def eligible_for(cls, user, order_total):
+        """
+        Coupons the user can apply to an order of order_total right now:
+        every valid promo coupon plus the user's own. One query on the kind
+        and owner indexes, however many referral coupons exist.
+        """
+        now = timezone.now()
+        return cls.objects.filter(
+            models.Q(kind=cls.PROMO) | models.Q(owner=user),
+            is_active=True,
+            valid_from__lte=now,
+            valid_until__gte=now,
+            minimum_order_amount__lte=order_total
+        ).filter(
+            models.Q(usage_limit__isnull=True) | models.Q(usage_count__lt=models.F('usage_limit'))
+        ).order_by('-discount_value')
+
+    def is_available_to(self, user):
+        """Promo and campaign codes are open to everyone, other coupons only to their owner"""
+        return self.kind in (self.PROMO, self.CAMPAIGN) or (self.owner_id is not None and self.owner_id == user.pk)
+
     @property
     def is_valid(self):
         """Check if the coupon is valid for use"""
@@ -217,6 +389,71 @@ class Coupon(models.Model):
         return min(discount, order_total)  # Ensure discount doesn't exceed order total
 
 
+class CouponCampaign(models.Model):
+    """Template for a batch of generated single-use coupon codes"""
+    name = models.CharField(max_length=100)
+    description = models.TextField(blank=True, help_text="Description given to the campaign's coupons")
+    code_prefix = models.CharField(max_length=8, blank=True, help_text="Uppercase letters or digits starting every code (e.g., SUMMER)")
+    coupon_type = models.CharField(max_length=20, choices=Coupon.COUPON_TYPES, default='percentage')
+    discount_value = models.DecimalField(max_digits=10, decimal_places=2, help_text="Discount amount or percentage")
+    minimum_order_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Minimum order amount to apply a code")
+    max_discount_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Maximum discount cap for percentage coupons")
+    valid_from = models.DateTimeField(default=timezone.now)
+    valid_until = models.DateTimeField()
+    usage_limit = models.PositiveIntegerField(default=1, help_text="Number of times each code can be used")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Coupons inserted per query when generating codes
+    GENERATE_BATCH_SIZE = 1000
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.name
+
+    def build_coupon(self, code):
+        """Unsaved coupon for code with the campaign's terms"""
+        return Coupon(
+            code=code,
+            description=self.description or f"{self.name} campaign",
+            coupon_type=self.coupon_type,
+            discount_value=self.discount_value,
+            minimum_order_amount=self.minimum_order_amount,
+            max_discount_amount=self.max_discount_amount,
+            valid_from=self.valid_from,
+            valid_until=self.valid_until,
+            usage_limit=self.usage_limit,
+            kind=Coupon.CAMPAIGN,
+            campaign=self
+        )
+
+    def clean(self):
+        """Apply the coupon rules once here, so generated coupons can skip them"""
+        if None in (self.discount_value, self.minimum_order_amount, self.valid_from, self.valid_until):
+            return  # Reported as field errors
+        self.build_coupon(f"{self.code_prefix}{'0' * SECRET_CODE_LENGTH}").clean()
+
+    def generate_coupons(self, count, batch_size=GENERATE_BATCH_SIZE):
+        """
+        Create count coupons for the campaign and return how many were made.
+        Codes are random, since anyone holding one can redeem it, so seeing
+        one code says nothing about the others. One query per batch drops
+        codes that already exist, to be replaced in the next batch, and each
+        batch is one bulk insert without Coupon's per-row full_clean. All
+        batches commit together.
+        """
+        created = 0
+        with transaction.atomic():
+            while created < count:
+                codes = {f"{self.code_prefix}{secret_code()}" for _ in range(min(batch_size, count - created))}
+                taken = set(Coupon.objects.filter(code__in=codes).values_list('code', flat=True))
+                created += len(Coupon.objects.bulk_create(
+                    [self.build_coupon(code) for code in codes if code not in taken]
+                ))
+        return created
+
+
 class Offer(models.Model):
     OFFER_TYPES = [
         ('product', 'Product Offer'),
@@ -261,42 +498,74 @@ class CategoryOffer(models.Model):
     def __str__(self):
         return f"{self.offer.name} for {self.category.name}"
 
+
+# Product Card Model
+class ProductCard(models.Model):
+    """
+    Denormalized listing row for a product, maintained by back_office.product_cards.
+    Offer pricing is valid until pricing_expires_at, when the next offer starts or ends.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='product_cards')
+    name = models.CharField(max_length=255)
+    cover_image = models.CharField(max_length=255, blank=True)
+    cover_widths = models.JSONField(default=dict, blank=True)
+    display_price = models.DecimalField(max_digits=10, decimal_places=2)
+    product_discount = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    category_discount = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    best_discount = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    offer_type = models.CharField(max_length=20, choices=Offer.OFFER_TYPES, blank=True)
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2)
+    category_blocked = models.BooleanField(default=False)
+    is_listed = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    pricing_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_listed', 'created_at']),
+            models.Index(fields=['is_listed', 'effective_price']),
+            models.Index(fields=['category', 'is_listed']),
+            models.Index(fields=['pricing_expires_at']),
+        ]
+
+    def __str__(self):
+        return f"Card for {self.name}"
+
 # Utility function to get best offer for a product
 def get_best_offer_for_product(product):
-    now = timezone.now()
-    
-    # Get valid product offers
-    product_offers = ProductOffer.objects.filter(
-        product=product,
-        offer__is_active=True,
-        offer__start_date__lte=now,
-        offer__end_date__gte=now
-    ).select_related('offer')
-    
-    # Get valid category offers
-    category_offers = CategoryOffer.objects.filter(
-        category=product.category,
-        offer__is_active=True,
-        offer__start_date__lte=now,
-        offer__end_date__gte=now
-    ).select_related('offer')
-    
-    best_discount = 0
-    best_offer = None
-    
-    # Check product offers
-    for po in product_offers:
-        if po.offer.discount_percentage > best_discount:
-            best_discount = po.offer.discount_percentage
-            best_offer = po.offer
-    
-    # Check category offers
-    for co in category_offers:
-        if co.offer.discount_percentage > best_discount:
-            best_discount = co.offer.discount_percentage
-            best_offer = co.offer
-    
-    return best_offer
+    return get_best_offers_for_products([product]).get(product.pk)
+
+# Utility function to get best offers for many products from the offer schedule
+def get_best_offers_for_products(products):
+    """
+    Resolve the best live offer for a collection of products or product IDs.
+    Returns a dict mapping product ID to Offer; products without a live offer
+    are left out. Product offers win ties against category offers.
+
+    Offers come from the per-worker offer schedule, so passing Product
+    instances needs no queries; bare IDs cost one query for their categories.
+    """
+    from .offer_schedule import offer_schedule
+
+    product_categories = {}
+    product_ids = []
+    for product in products:
+        if isinstance(product, Product):
+            product_categories[product.pk] = product.category_id
+        else:
+            product_ids.append(product)
+
+    if product_ids:
+        product_categories.update(
+            Product.objects.filter(id__in=product_ids).values_list('id', 'category_id')
+        )
+
+    if not product_categories:
+        return {}
+
+    return offer_schedule.best_offers(product_categories)
+
 
 class Referral(models.Model):
     referrer = models.ForeignKey(
@@ -329,7 +598,7 @@ class Referral(models.Model):
         """Create referral coupons for both referrer and referred user"""
         # Coupon for referrer
         referrer_coupon = Coupon.objects.create(
-            code=f"REF{self.referrer.referral_code[:6]}{random.randint(1000, 9999)}",
+            code=f"REF{next_code()}",
             description=f"Referral reward for referring {self.referred_user.email}",
             coupon_type='fixed',
             discount_value=Decimal('50.00'),
@@ -337,12 +606,14 @@ class Referral(models.Model):
             valid_from=timezone.now(),
             valid_until=timezone.now() + timezone.timedelta(days=30),
             usage_limit=1,
-            is_active=True
+            is_active=True,
+            kind=Coupon.REFERRER_REWARD,
+            owner=self.referrer
         )
 
         # Coupon for referred user
         referred_coupon = Coupon.objects.create(
-            code=f"NEW{self.referred_user.referral_code[:6]}{random.randint(1000, 9999)}",
+            code=f"NEW{next_code()}",
             description=f"Welcome coupon for {self.referred_user.email}",
             coupon_type='fixed',
             discount_value=Decimal('100.00'),
@@ -350,7 +621,9 @@ class Referral(models.Model):
             valid_from=timezone.now(),
             valid_until=timezone.now() + timezone.timedelta(days=30),
             usage_limit=1,
-            is_active=True
+            is_active=True,
+            kind=Coupon.WELCOME,
+            owner=self.referred_user
         )
 
         self.referrer_coupon = referrer_coupon
@@ -0,0 +1,112 @@
+import bisect
+import threading
+
+from django.utils import timezone
+
+from .cache_versions import OFFER_SCHEDULE_VERSION_KEY, get_version
+from .models import Offer
+
+
+class OfferSchedule:
+    """
+    Per-worker compiled timeline of live and upcoming offers.
+
+    Product and category IDs map to their offer intervals sorted by start
+    date. The timeline is rebuilt lazily when the shared version changes;
+    window boundaries are handled at lookup time, so offers start and
+    expire without touching the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._product_intervals = {}
+        self._category_intervals = {}
+        self._boundaries = []
+        # (start, end, product best, category best), replaced as one value
+        self._window = None
+
+    def _rebuild(self, version):
+        now = timezone.now()
+        product_intervals = {}
+        category_intervals = {}
+        boundaries = set()
+
+        offers = Offer.objects.filter(
+            is_active=True,
+            end_date__gte=now
+        ).select_related('product_offer', 'category_offer')
+
+        for offer in offers:
+            interval = (offer.start_date, offer.end_date, offer)
+            if hasattr(offer, 'product_offer'):
+                product_intervals.setdefault(offer.product_offer.product_id, []).append(interval)
+            if hasattr(offer, 'category_offer'):
+                category_intervals.setdefault(offer.category_offer.category_id, []).append(interval)
+            boundaries.add(offer.start_date)
+            # Offers are valid up to and including end_date
+            boundaries.add(offer.end_date + timezone.timedelta(microseconds=1))
+
+        for intervals in (*product_intervals.values(), *category_intervals.values()):
+            intervals.sort(key=lambda interval: interval[0])
+
+        self._product_intervals = product_intervals
+        self._category_intervals = category_intervals
+        self._boundaries = sorted(boundaries)
+        self._window = None
+        self._version = version
+
+    def _refresh(self, now):
+        version = get_version(OFFER_SCHEDULE_VERSION_KEY)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._rebuild(version)
+
+        # Recompute the best offers only when a window boundary is crossed
+        window = self._window
+        if window is None or not (window[0] <= now < window[1]):
+            with self._lock:
+                index = bisect.bisect_right(self._boundaries, now)
+                window = (
+                    self._boundaries[index - 1] if index else timezone.datetime.min.replace(tzinfo=now.tzinfo),
+                    self._boundaries[index] if index < len(self._boundaries) else timezone.datetime.max.replace(tzinfo=now.tzinfo),
+                    self._best_by_key(self._product_intervals, now),
+                    self._best_by_key(self._category_intervals, now),
+                )
+                self._window = window
+        return window
+
+    @staticmethod
+    def _best_by_key(intervals_by_key, now):
+        best_by_key = {}
+        for key, intervals in intervals_by_key.items():
+            best = None
+            for start_date, end_date, offer in intervals:
+                if start_date > now:
+                    break
+                if end_date >= now and offer.discount_percentage > (best.discount_percentage if best else 0):
+                    best = offer
+            if best:
+                best_by_key[key] = best
+        return best_by_key
+
+    def best_offers(self, product_categories):
+        """
+        Resolve the best live offer for a mapping of product ID to category ID.
+        Product offers win ties against category offers.
+        """
+        _, _, product_best, category_best = self._refresh(timezone.now())
+
+        best_offers = {}
+        for product_id, category_id in product_categories.items():
+            best = product_best.get(product_id)
+            category_offer = category_best.get(category_id)
+            if category_offer and category_offer.discount_percentage > (best.discount_percentage if best else 0):
+                best = category_offer
+            if best:
+                best_offers[product_id] = best
+        return best_offers
+
+
+offer_schedule = OfferSchedule()
@@ -0,0 +1,148 @@
+import datetime
+import hashlib
+from decimal import Decimal
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+
+CURSOR_SALT = 'back_office.pagination.cursor'
+
+# Seconds an approximate total is reused before it is counted again
+APPROXIMATE_COUNT_TIMEOUT = 300
+
+
+class CursorPage:
+    """One page of a CursorPaginator; iterates like a Paginator page"""
+
+    def __init__(self, object_list, offset, has_next, has_previous, next_token, previous_token, approximate_count):
+        self.object_list = object_list
+        self.offset = offset
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.next_token = next_token
+        self.previous_token = previous_token
+        self.approximate_count = approximate_count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    def start_index(self):
+        """1-based position of the first object on this page"""
+        return self.offset + 1 if self.object_list else 0
+
+    def end_index(self):
+        return self.offset + len(self.object_list)
+
+
+class CursorPaginator:
+    """
+    Keyset paginator over an ordering such as ['-created_at', '-id'].
+
+    Pages are selected with a WHERE clause on the last row's sort values
+    instead of OFFSET, and no COUNT(*) is issued, so deep pages cost the same
+    as the first one. The ordering must end in a unique, non-null field (the
+    primary key) and may only name model fields or annotations. Next/previous
+    tokens are signed and name their ordering, so they are opaque to clients,
+    safe to accept back and ignored once the ordering changes. Pass
+    count_key, a tuple of the view's filter parameters, to expose a cached
+    total for display; it must identify the filtered rows.
+    """
+
+    def __init__(self, queryset, ordering, per_page, count_key=None):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.count_key = count_key
+
+    @staticmethod
+    def _field(order):
+        return order.lstrip('-')
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, Decimal):
+            return str(value)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return value
+
+    def _token(self, direction, obj, position):
+        # position is the anchor row's offset, carried along for row numbering
+        values = [self._encode_value(getattr(obj, self._field(order))) for order in self.ordering]
+        return signing.dumps(
+            {'d': direction, 'o': self.ordering, 'v': values, 'i': position}, salt=CURSOR_SALT, compress=True
+        )
+
+    def _decode(self, token):
+        if not token:
+            return None, None, 0
+        try:
+            data = signing.loads(token, salt=CURSOR_SALT)
+            direction, ordering, values, position = data['d'], data['o'], data['v'], int(data['i'])
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            return None, None, 0
+        # A cursor from another sort order would compare values of the wrong fields
+        if direction not in ('n', 'p') or ordering != self.ordering or len(values) != len(self.ordering):
+            return None, None, 0
+        return direction, values, position
+
+    def _keyset_filter(self, values, reverse):
+        """Rows strictly after values in the ordering (before them if reverse)"""
+        condition = Q()
+        equal = Q()
+        for order, value in zip(self.ordering, values):
+            field = self._field(order)
+            descending = order.startswith('-') != reverse
+            lookup = f'{field}__lt' if descending else f'{field}__gt'
+            condition |= equal & Q(**{lookup: value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def _count(self):
+        # Keyed on the filters rather than the SQL, which may embed the current time
+        key = 'cursor_count:' + hashlib.md5(repr(self.count_key).encode('utf-8')).hexdigest()
+        return cache.get_or_set(key, self.queryset.count, APPROXIMATE_COUNT_TIMEOUT)
+
+    def get_page(self, token):
+        direction, values, position = self._decode(token)
+        reverse = direction == 'p'
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(values, reverse))
+        if reverse:
+            ordering = [order[1:] if order.startswith('-') else f'-{order}' for order in self.ordering]
+        else:
+            ordering = self.ordering
+
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+            offset = max(position - len(rows), 0)
+        else:
+            has_next, has_previous = has_more, values is not None
+            offset = position + 1 if values is not None else 0
+
+        next_token = self._token('n', rows[-1], offset + len(rows) - 1) if has_next and rows else None
+        previous_token = self._token('p', rows[0], offset) if has_previous and rows else None
+        approximate_count = self._count() if self.count_key is not None else None
+
+        return CursorPage(rows, offset, has_next, has_previous, next_token, previous_token, approximate_count)
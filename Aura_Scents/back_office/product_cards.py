@@ -0,0 +1,181 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .cache_versions import LISTING_VERSION_KEY, bump_version
+from .models import CategoryOffer, MediaBlob, Product, ProductCard, ProductOffer, ProductVariant
+
+
+# Earliest pricing_expires_at over all cards, shared so listing requests
+# only touch the card table when some card actually needs repricing
+NEXT_EXPIRY_CACHE_KEY = 'product_card_next_expiry'
+
+# Seconds the shared expiry is trusted before it is read from the table again
+NEXT_EXPIRY_TIMEOUT = 300
+
+NEVER = timezone.datetime.max.replace(tzinfo=timezone.get_fixed_timezone(0))
+
+CARD_UPDATE_FIELDS = [
+    'category', 'name', 'cover_image', 'cover_widths', 'display_price', 'product_discount',
+    'category_discount', 'best_discount', 'offer_type', 'effective_price',
+    'category_blocked', 'is_listed', 'created_at', 'pricing_expires_at',
+]
+
+
+def _offer_windows(queryset, key, keys, now):
+    """Map each key to [(start_date, end_date, discount_percentage)] for live and upcoming offers"""
+    windows = {}
+    offers = queryset.filter(
+        **{f'{key}__in': keys},
+        offer__is_active=True,
+        offer__end_date__gte=now
+    ).values_list(key, 'offer__start_date', 'offer__end_date', 'offer__discount_percentage')
+    for target_id, start_date, end_date, discount in offers:
+        windows.setdefault(target_id, []).append((start_date, end_date, discount))
+    return windows
+
+
+def _price_windows(windows, now):
+    """Best discount live at now, and when that can next change"""
+    best = Decimal('0.00')
+    expires_at = None
+    for start_date, end_date, discount in windows:
+        if start_date > now:
+            change = start_date
+        else:
+            best = max(best, discount)
+            # Offers are valid up to and including end_date
+            change = end_date + timezone.timedelta(microseconds=1)
+        expires_at = change if expires_at is None else min(expires_at, change)
+    return best, expires_at
+
+
+def refresh_product_cards(product_ids):
+    """Recompute and upsert the cards for the given product IDs"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    now = timezone.now()
+
+    products = list(Product.objects.filter(id__in=product_ids).select_related('category', 'cover_image'))
+    if not products:
+        return
+    product_ids = [product.id for product in products]
+    category_ids = {product.category_id for product in products}
+
+    first_variant = {}
+    variants = ProductVariant.objects.filter(
+        product_id__in=product_ids,
+        is_deleted=False,
+        is_blocked=False
+    ).order_by('created_at', 'id').values_list('product_id', 'price')
+    for product_id, price in variants:
+        first_variant.setdefault(product_id, price)
+
+    covers = {
+        product.id: product.cover_image.image.name
+        for product in products if product.cover_image and product.cover_image.is_ready
+    }
+    cover_widths = dict(
+        MediaBlob.objects.filter(name__in=covers.values()).values_list('name', 'derivative_widths')
+    ) if covers else {}
+
+    product_windows = _offer_windows(ProductOffer.objects, 'product_id', product_ids, now)
+    category_windows = _offer_windows(CategoryOffer.objects, 'category_id', category_ids, now)
+
+    cards = []
+    for product in products:
+        category = product.category
+        product_discount, product_expiry = _price_windows(product_windows.get(product.id, []), now)
+        category_discount, category_expiry = _price_windows(category_windows.get(category.id, []), now)
+        best_discount = max(product_discount, category_discount)
+        expiries = [expiry for expiry in (product_expiry, category_expiry) if expiry]
+
+        # Product offers win ties, matching get_best_offer_for_product
+        if not best_discount:
+            offer_type = ''
+        elif product_discount >= category_discount:
+            offer_type = 'product'
+        else:
+            offer_type = 'category'
+
+        display_price = first_variant.get(product.id, product.price)
+
+        effective_price = (display_price * (Decimal('100') - best_discount) / Decimal('100')).quantize(
+            Decimal('0.01'), rounding=ROUND_HALF_UP
+        )
+        category_blocked = category.is_blocked or category.is_deleted
+
+        cards.append(ProductCard(
+            product=product,
+            category_id=category.id,
+            name=product.name,
+            cover_image=covers.get(product.id, ''),
+            cover_widths=cover_widths.get(covers.get(product.id), {}),
+            display_price=display_price,
+            product_discount=product_discount,
+            category_discount=category_discount,
+            best_discount=best_discount,
+            offer_type=offer_type,
+            effective_price=effective_price,
+            category_blocked=category_blocked,
+            is_listed=not (product.is_blocked or product.is_deleted or category_blocked),
+            created_at=product.created_at,
+            pricing_expires_at=min(expiries) if expiries else None,
+        ))
+
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    unique_fields = ['product'] if connection.features.supports_update_conflicts_with_target else None
+    ProductCard.objects.bulk_create(
+        cards,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=CARD_UPDATE_FIELDS,
+    )
+    transaction.on_commit(_cards_changed)
+
+
+def _cards_changed():
+    cache.delete(NEXT_EXPIRY_CACHE_KEY)
+    bump_version(LISTING_VERSION_KEY)
+
+
+def refresh_category_cards(category_ids):
+    refresh_product_cards(Product.objects.filter(category_id__in=category_ids).values_list('id', flat=True))
+
+
+def refresh_expired_cards():
+    """Reprice cards whose offer window has ended or whose next offer has started"""
+    now = timezone.now()
+    next_expiry = cache.get(NEXT_EXPIRY_CACHE_KEY)
+    if next_expiry is None:
+        next_expiry = ProductCard.objects.aggregate(
+            next_expiry=models.Min('pricing_expires_at')
+        )['next_expiry'] or NEVER
+        cache.set(NEXT_EXPIRY_CACHE_KEY, next_expiry, NEXT_EXPIRY_TIMEOUT)
+    if next_expiry > now:
+        return
+
+    with transaction.atomic():
+        refresh_product_cards(
+            ProductCard.objects.filter(pricing_expires_at__lte=now).values_list('product_id', flat=True)
+        )
+
+
+def listed_cards():
+    """ProductCard queryset of products currently shown in the storefront"""
+    refresh_expired_cards()
+    return ProductCard.objects.filter(is_listed=True)
+
+
+def rebuild_product_cards(batch_size=1000):
+    """Recompute the card of every product; returns the number written"""
+    product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    with transaction.atomic():
+        ProductCard.objects.all().delete()
+        for start in range(0, len(product_ids), batch_size):
+            refresh_product_cards(product_ids[start:start + batch_size])
+    return len(product_ids)
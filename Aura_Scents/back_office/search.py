@@ -0,0 +1,274 @@
+import bisect
+import math
+import re
+import threading
+from collections import Counter
+from operator import itemgetter
+
+from django.db import connection, models, transaction
+from django.db.models.expressions import RawSQL
+
+from .cache_versions import SEARCH_INDEX_VERSION_KEY, bump_version, get_version
+from .models import Product, ProductSearchDocument
+from .pagination import CursorPage, CursorPaginator
+
+
+# Field weights used when building the in-process index
+NAME_WEIGHT = 3
+CATEGORY_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def build_document(product):
+    """Search text for a product: name, category name and description"""
+    return '\n'.join([product.name, product.category.name, product.description])
+
+
+def update_search_documents(products):
+    """Write the search documents for the given products"""
+    products = list(products)
+    if not products:
+        return
+    documents = [
+        ProductSearchDocument(product=product, document=build_document(product))
+        for product in products
+    ]
+    # MySQL upserts on any unique key and rejects an explicit conflict target
+    unique_fields = ['product'] if connection.features.supports_update_conflicts_with_target else None
+    ProductSearchDocument.objects.bulk_create(
+        documents,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=['document', 'updated_at'],
+    )
+    transaction.on_commit(lambda: bump_version(SEARCH_INDEX_VERSION_KEY))
+
+
+def rebuild_search_index(batch_size=1000):
+    """Rebuild every product search document; returns the number indexed"""
+    products = Product.objects.select_related('category').order_by('id')
+    total = 0
+    with transaction.atomic():
+        ProductSearchDocument.objects.all().delete()
+        batch = []
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(ProductSearchDocument(product=product, document=build_document(product)))
+            if len(batch) >= batch_size:
+                ProductSearchDocument.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            ProductSearchDocument.objects.bulk_create(batch)
+            total += len(batch)
+        transaction.on_commit(lambda: bump_version(SEARCH_INDEX_VERSION_KEY))
+    return total
+
+
+class InvertedIndex:
+    """
+    Per-worker inverted index over product search documents, used when the
+    database has no FULLTEXT support (SQLite in development and tests).
+
+    Terms map to {product_id: weighted term frequency}. The sorted term list
+    allows prefix matching on the last query token, so partially typed
+    searches still match. Rebuilt lazily when the shared version changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._postings = {}
+        self._terms = []
+        self._document_count = 0
+
+    def _rebuild(self, version):
+        postings = {}
+        document_count = 0
+        documents = ProductSearchDocument.objects.values_list('product_id', 'document')
+        for product_id, document in documents.iterator(chunk_size=2000):
+            name, _, rest = document.partition('\n')
+            category, _, description = rest.partition('\n')
+            weights = Counter()
+            for token in tokenize(name):
+                weights[token] += NAME_WEIGHT
+            for token in tokenize(category):
+                weights[token] += CATEGORY_WEIGHT
+            for token in tokenize(description):
+                weights[token] += DESCRIPTION_WEIGHT
+            for token, weight in weights.items():
+                postings.setdefault(token, {})[product_id] = weight
+            document_count += 1
+
+        self._postings = postings
+        self._terms = sorted(postings)
+        self._document_count = document_count
+        self._version = version
+
+    def _refresh(self):
+        version = get_version(SEARCH_INDEX_VERSION_KEY)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._rebuild(version)
+
+    def _prefix_terms(self, prefix):
+        start = bisect.bisect_left(self._terms, prefix)
+        terms = []
+        for term in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query, limit=None):
+        """Return [(product_id, score)] for products matching every query token, best first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        self._refresh()
+
+        scores = None
+        for position, token in enumerate(tokens):
+            # Only the last token may still be in the middle of being typed
+            terms = self._prefix_terms(token) if position == len(tokens) - 1 else [token]
+            token_scores = Counter()
+            for term in terms:
+                postings = self._postings.get(term, {})
+                idf = math.log(1 + self._document_count / len(postings)) if postings else 0
+                for product_id, weight in postings.items():
+                    token_scores[product_id] += weight * idf
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = Counter({
+                    product_id: score + token_scores[product_id]
+                    for product_id, score in scores.items()
+                    if product_id in token_scores
+                })
+            if not scores:
+                return []
+
+        return scores.most_common(limit)
+
+
+inverted_index = InvertedIndex()
+
+
+def search_products(queryset, query):
+    """
+    Filter a Product (or ProductCard) queryset to matches for query and
+    annotate search_rank. Uses the MySQL FULLTEXT index when available,
+    otherwise the in-process inverted index, which sends every hit to the
+    database; page through results with search_paginator instead.
+    """
+    # Empty results still carry search_rank so callers can order by it
+    no_results = queryset.annotate(search_rank=models.Value(0.0, output_field=models.FloatField())).none()
+
+    tokens = tokenize(query)
+    if not tokens:
+        return no_results
+
+    if connection.vendor == 'mysql':
+        # Boolean mode: every token required, prefix match on each token
+        against = ' '.join(f'+{token}*' for token in tokens)
+        match_sql = 'MATCH(document) AGAINST (%s IN BOOLEAN MODE)'
+        meta = queryset.model._meta
+        return queryset.filter(
+            pk__in=RawSQL(
+                f'SELECT product_id FROM back_office_productsearchdocument WHERE {match_sql}',
+                (against,)
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT {match_sql} FROM back_office_productsearchdocument '
+                f'WHERE product_id = {meta.db_table}.{meta.pk.column}',
+                (against,),
+                output_field=models.FloatField()
+            )
+        )
+
+    # Every hit: the caller's availability, category and price filters and
+    # pagination apply afterwards, so capping here would drop matches
+    hits = inverted_index.search(query)
+    if not hits:
+        return no_results
+    return queryset.filter(pk__in=[product_id for product_id, _ in hits]).annotate(
+        search_rank=models.Case(
+            *[models.When(pk=product_id, then=models.Value(score)) for product_id, score in hits],
+            default=models.Value(0.0),
+            output_field=models.FloatField()
+        )
+    )
+
+
+class HitPaginator(CursorPaginator):
+    """
+    CursorPaginator over in-process search hits. Only the sort values of the
+    filtered rows are read; they are intersected with the hits and sorted and
+    sliced in Python, so just the page's rows are fetched by primary key.
+    """
+
+    def __init__(self, queryset, scores, ordering, per_page, count_key=None):
+        super().__init__(queryset, ordering, per_page, count_key)
+        self.scores = scores
+
+    def _matches(self):
+        fields = [self._field(order) for order in self.ordering]
+        columns = list(dict.fromkeys(field for field in fields + ['pk'] if field != 'search_rank'))
+        rows = []
+        for row in self.queryset.values(*columns).iterator(chunk_size=2000):
+            score = self.scores.get(row['pk'])
+            if score is not None:
+                row['search_rank'] = score
+                rows.append(row)
+        # Stable sorts from the last key to the first give a mixed-direction ordering
+        for field, order in reversed(list(zip(fields, self.ordering))):
+            rows.sort(key=itemgetter(field), reverse=order.startswith('-'))
+        return rows
+
+    def get_page(self, token):
+        direction, values, _ = self._decode(token)
+        rows = self._matches()
+
+        # The ordering ends in the primary key, which locates the anchor row;
+        # a cursor whose row has left the results starts over
+        anchor = None
+        if values is not None:
+            anchor = next((index for index, row in enumerate(rows) if row['pk'] == values[-1]), None)
+        if anchor is None:
+            start = 0
+        elif direction == 'p':
+            start = max(anchor - self.per_page, 0)
+        else:
+            start = anchor + 1
+        end = anchor if anchor is not None and direction == 'p' else start + self.per_page
+        page_rows = rows[start:end]
+
+        found = self.queryset.in_bulk([row['pk'] for row in page_rows])
+        objects = []
+        for row in page_rows:
+            obj = found.get(row['pk'])
+            if obj is not None:
+                obj.search_rank = row['search_rank']
+                objects.append(obj)
+
+        has_next, has_previous = end < len(rows), start > 0
+        next_token = self._token('n', objects[-1], start + len(objects) - 1) if has_next and objects else None
+        previous_token = self._token('p', objects[0], start) if has_previous and objects else None
+        count = len(rows) if self.count_key is not None else None
+
+        return CursorPage(objects, start, has_next, has_previous, next_token, previous_token, count)
+
+
+def search_paginator(queryset, query, ordering, per_page, count_key=None):
+    """CursorPaginator over the matches for query in queryset, which may order by search_rank"""
+    if connection.vendor == 'mysql' or not tokenize(query):
+        return CursorPaginator(search_products(queryset, query), ordering, per_page, count_key)
+    return HitPaginator(queryset, dict(inverted_index.search(query)), ordering, per_page, count_key)
@@ -0,0 +1,132 @@
+from django.db import transaction
+from django.db.models import Subquery
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Category, Product, ProductVariant, ProductImage, Offer, ProductOffer, CategoryOffer, MediaBlob, User
+from .cache_versions import CATALOG_VERSION_KEY, LISTING_VERSION_KEY, OFFER_SCHEDULE_VERSION_KEY, bump_version
+from .product_cards import refresh_category_cards, refresh_product_cards
+from .search import update_search_documents
+
+
+@receiver(post_save, sender=Offer)
+@receiver(post_delete, sender=Offer)
+@receiver(post_save, sender=ProductOffer)
+@receiver(post_delete, sender=ProductOffer)
+@receiver(post_save, sender=CategoryOffer)
+@receiver(post_delete, sender=CategoryOffer)
+def invalidate_offer_schedule(sender, **kwargs):
+    # Wait for the commit so other workers rebuild from the new rows
+    transaction.on_commit(lambda: bump_version(OFFER_SCHEDULE_VERSION_KEY))
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_search_documents([instance])
+
+
+@receiver(post_save, sender=Category)
+def update_category_search_documents(sender, instance, created=False, raw=False, **kwargs):
+    # A renamed category changes the search text of all of its products
+    if not raw and not created:
+        update_search_documents(instance.products.select_related('category'))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(CATALOG_VERSION_KEY))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_listing_pages(sender, **kwargs):
+    # New and deleted categories change the catalog filters without touching any card
+    transaction.on_commit(lambda: bump_version(LISTING_VERSION_KEY))
+
+
+# Cover image receivers are registered before the card receivers below,
+# so a refreshed card already sees the new cover
+@receiver(post_save, sender=ProductImage)
+def set_default_cover_image(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        Product.objects.filter(pk=instance.product_id, cover_image__isnull=True).update(cover_image=instance)
+
+
+@receiver(post_save, sender=ProductImage)
+def acquire_product_image(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        MediaBlob.acquire(instance.image.name)
+
+
+@receiver(post_delete, sender=ProductImage)
+def release_product_image(sender, instance, **kwargs):
+    MediaBlob.release(instance.image.name)
+
+
+@receiver(post_delete, sender=User)
+def release_profile_image(sender, instance, **kwargs):
+    MediaBlob.release(instance.profile_image.name)
+
+
+@receiver(post_delete, sender=ProductImage)
+def replace_deleted_cover_image(sender, instance, **kwargs):
+    # The deleted cover was already nulled by SET_NULL; promote the oldest remaining image
+    next_image = ProductImage.objects.filter(product_id=instance.product_id).order_by('id').values('id')[:1]
+    Product.objects.filter(pk=instance.product_id, cover_image__isnull=True).update(
+        cover_image=Subquery(next_image)
+    )
+
+
+def _refresh_cards(refresh, ids, signal):
+    # Cascading deletes remove child rows before the product itself, so
+    # wait for the commit instead of writing a card for a row being deleted
+    if signal is post_delete:
+        ids = list(ids)
+        transaction.on_commit(lambda: refresh(ids))
+    else:
+        refresh(ids)
+
+
+@receiver(post_save, sender=Product)
+def update_product_card(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_product_cards([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductOffer)
+@receiver(post_delete, sender=ProductOffer)
+def update_card_for_product(sender, instance, signal, raw=False, **kwargs):
+    # Price, cover image and offers come from these rows
+    if not raw:
+        _refresh_cards(refresh_product_cards, [instance.product_id], signal)
+
+
+@receiver(post_save, sender=CategoryOffer)
+@receiver(post_delete, sender=CategoryOffer)
+def update_cards_for_category_offer(sender, instance, signal, raw=False, **kwargs):
+    if not raw:
+        _refresh_cards(refresh_category_cards, [instance.category_id], signal)
+
+
+@receiver(post_save, sender=Category)
+def update_category_cards(sender, instance, created=False, raw=False, **kwargs):
+    # Blocking or deleting a category delists all of its products
+    if not raw and not created:
+        refresh_category_cards([instance.pk])
+
+
+@receiver(post_save, sender=Offer)
+def update_offer_cards(sender, instance, created=False, raw=False, **kwargs):
+    # New offers have no targets yet; deletes cascade through the targets above
+    if raw or created:
+        return
+    refresh_product_cards(ProductOffer.objects.filter(offer=instance).values_list('product_id', flat=True))
+    refresh_category_cards(CategoryOffer.objects.filter(offer=instance).values_list('category_id', flat=True))
@@ -0,0 +1,44 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Media storage that names files by the SHA-256 of their content.
+
+    The upload_to directory and extension are kept, so an upload to
+    products/abc.JPG is stored as products/<h[:2]>/<h>.jpg. Saving content
+    that is already stored writes nothing and returns the existing name.
+    References are counted in MediaBlob; unreferenced files are removed in
+    bulk by the gc_media command rather than deleted one by one.
+    """
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], f'{digest}{extension}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+media_storage = ContentAddressedStorage()
+
+
+def get_media_storage():
+    return media_storage
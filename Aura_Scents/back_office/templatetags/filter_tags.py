@@ -1,5 +1,5 @@
 from django import template
-from urllib.parse import urlencode
+from django.http import QueryDict
 
 register = template.Library()
 
@@ -9,11 +9,16 @@ def subtract(value, arg):
 
 @register.simple_tag(takes_context=True)
 def querystring(context, **kwargs):
+    """Current query string with kwargs replaced; a None value drops the key"""
     try:
         request = context['request']
         query_dict = request.GET.copy()
     except KeyError:
-        query_dict = {}  # Fallback to empty dict if request is missing
-    query_dict.update(kwargs)
-    query_string = urlencode(query_dict)
-    return f'?{query_string}' if query_string else ''
\ No newline at end of file
+        query_dict = QueryDict(mutable=True)  # Fallback to empty dict if request is missing
+    for key, value in kwargs.items():
+        if value is None:
+            query_dict.pop(key, None)
+        else:
+            query_dict[key] = value
+    query_string = query_dict.urlencode()
+    return f'?{query_string}' if query_string else ''
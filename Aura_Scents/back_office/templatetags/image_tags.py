@@ -0,0 +1,106 @@
+from django import template
+from django.urls import reverse
+from django.utils.html import format_html
+
+from back_office.images import DERIVATIVE_FORMATS, IMAGE_SIZES, derivative_url
+from back_office.models import Product, ProductImage
+from back_office.thumbnails import UnreadableImage, get_thumbnail, is_allowed
+
+register = template.Library()
+
+
+def _image_name(image):
+    """
+    Storage name from a ProductImage, an image field file or a plain name;
+    '' for a ProductImage whose derivatives are not ready yet
+    """
+    if not image:
+        return ''
+    if isinstance(image, ProductImage):
+        if not image.is_ready:
+            return ''
+        image = image.image
+    return getattr(image, 'name', image) or ''
+
+@register.filter
+def cover_image_url(product, size=None):
+    """Cover image URL for a product (a derivative when size is given), or '' when it has none"""
+    image = product.get_cover_image() if product else None
+    if not image:
+        return ''
+    if not size:
+        return image.image.url
+    return derivative_url(image.image.name, size) if image.is_ready else ''
+
+@register.filter
+def image_url(image, size):
+    """JPEG derivative URL of an image at one of the configured sizes"""
+    name = _image_name(image)
+    return derivative_url(name, size) if name else ''
+
+def _thumbnail_spec(spec):
+    size, _, extension = spec.partition('.')
+    extension = extension or 'jpg'
+    if not is_allowed(size, extension):
+        raise template.TemplateSyntaxError(f"Thumbnail spec {spec!r} is not allowed")
+    return size, extension
+
+@register.filter
+def thumbnail_url(image, spec):
+    """
+    URL of an on-demand thumbnail such as '120x120.webp' (JPEG when no
+    extension is given) for a ProductImage, a product's cover or an image ID
+    """
+    size, extension = _thumbnail_spec(spec)
+    if isinstance(image, Product):
+        image = image.cover_image_id
+    elif isinstance(image, ProductImage):
+        image = image.pk
+    if not image:
+        return ''
+    return reverse('product_thumbnail', args=[image, size, extension])
+
+@register.filter
+def thumbnail_file(image, spec):
+    """Local path of a thumbnail, for PDF renderers that read files rather than URLs"""
+    size, extension = _thumbnail_spec(spec)
+    if isinstance(image, Product):
+        image = image.get_cover_image()
+    if not image:
+        return ''
+    try:
+        return get_thumbnail(image.image.name, size, extension)
+    except (FileNotFoundError, UnreadableImage):
+        return ''
+
+@register.simple_tag
+def responsive_image(image, size='card', sizes='100vw', alt='', css_class='', widths=None, **attrs):
+    """
+    <picture> with WebP and JPEG srcsets over every configured size; the
+    img falls back to the JPEG at size. widths is the {size: width} recorded
+    for the image's derivatives (a card's cover_widths); without it only
+    the derivative at size is offered. Emits nothing for a missing image.
+    """
+    name = _image_name(image)
+    if not name:
+        return ''
+    if widths:
+        # Small originals are never upscaled, so several sizes can share a width
+        by_width = {}
+        for label, width in sorted(widths.items(), key=lambda item: IMAGE_SIZES.get(item[0], 0)):
+            if label in IMAGE_SIZES:
+                by_width.setdefault(width, label)
+        candidates = sorted(((label, width) for width, label in by_width.items()), key=lambda item: item[1])
+        srcsets = {
+            extension: ', '.join(f'{derivative_url(name, label, extension)} {width}w' for label, width in candidates)
+            for extension, _, _ in DERIVATIVE_FORMATS
+        }
+    else:
+        srcsets = {extension: derivative_url(name, size, extension) for extension, _, _ in DERIVATIVE_FORMATS}
+    extra = format_html(''.join(f' {key.replace("_", "-")}="{{}}"' for key in attrs), *attrs.values())
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy"{}></picture>',
+        srcsets['webp'], sizes,
+        derivative_url(name, size), srcsets['jpg'], sizes, alt, css_class, extra
+    )
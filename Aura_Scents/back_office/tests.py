@@ -1,3 +1,65 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.test import TestCase
+from django.utils import timezone
+
+from .identifiers import IdentifierAllocator
+from .models import Coupon, CouponCampaign
+
+
+class IdentifierAllocatorTests(TestCase):
+    """Blocks are never shared, even when a claim is rolled back"""
+
+    def test_rolled_back_claim_is_not_handed_out_again(self):
+        first, second = IdentifierAllocator(block_size=10), IdentifierAllocator(block_size=10)
+        try:
+            with transaction.atomic():
+                rolled_back = first.take(2)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        # The database may reissue the rolled-back block to the next claimer
+        others = second.take(10)
+        mine = first.take(2)
+        self.assertTrue(set(mine).isdisjoint(others))
+        self.assertTrue(set(mine).isdisjoint(rolled_back))
+
+
+class CouponCampaignTests(TestCase):
+    """Campaigns bulk-generate unique single-use codes"""
+
+    def setUp(self):
+        self.campaign = CouponCampaign.objects.create(
+            name='Influencer launch', code_prefix='INF', coupon_type='fixed',
+            discount_value=100, valid_until=timezone.now() + timedelta(days=30)
+        )
+
+    def test_generates_unique_single_use_codes(self):
+        self.assertEqual(self.campaign.generate_coupons(25, batch_size=10), 25)
+
+        codes = list(self.campaign.coupons.values_list('code', flat=True))
+        self.assertEqual(len(set(codes)), 25)
+        self.assertTrue(all(code.startswith('INF') for code in codes))
+        self.assertFalse(self.campaign.coupons.exclude(kind=Coupon.CAMPAIGN, usage_limit=1).exists())
+
+    def test_replaces_codes_already_taken(self):
+        taken = Coupon.objects.create(code='INFAAAAAAAAAA', discount_value=10, valid_until=self.campaign.valid_until)
+        drawn = ['AAAAAAAAAA', 'BBBBBBBBBB', 'CCCCCCCCCC', 'DDDDDDDDDD']
+
+        with mock.patch('back_office.models.secret_code', side_effect=drawn):
+            self.assertEqual(self.campaign.generate_coupons(3), 3)
+
+        codes = set(self.campaign.coupons.values_list('code', flat=True))
+        self.assertEqual(codes, {'INFBBBBBBBBBB', 'INFCCCCCCCCCC', 'INFDDDDDDDDDD'})
+        self.assertFalse(self.campaign.coupons.filter(pk=taken.pk).exists())
+
+    def test_validates_terms_with_coupon_rules(self):
+        self.campaign.coupon_type = 'percentage'
+        self.campaign.discount_value = 150
 
-# Create your tests here.
+        with self.assertRaises(ValidationError):
+            self.campaign.full_clean()
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import os
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image, ImageOps
+
+from .images import _open_rgb
+
+
+# Allowed "<width>x<height>" specs; images are cropped to fill the box
+THUMBNAIL_SPECS = set(getattr(settings, 'THUMBNAIL_SPECS', {
+    '48x48', '60x60', '80x80', '120x120', '160x160', '240x240',
+}))
+
+# Extension -> (content type, Pillow format, save options)
+THUMBNAIL_FORMATS = {
+    'webp': ('image/webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('image/jpeg', 'JPEG', {'quality': 85, 'optimize': True}),
+    'png': ('image/png', 'PNG', {'optimize': True}),
+}
+
+THUMBNAIL_CACHE_DIR = getattr(
+    settings, 'THUMBNAIL_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'thumbnail_cache')
+)
+
+# Bytes on disk before the least recently used thumbnails are evicted
+THUMBNAIL_CACHE_MAX_BYTES = getattr(settings, 'THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+
+# Eviction trims the cache to this fraction of the cap, so it does not run on every write
+THUMBNAIL_CACHE_LOW_WATER = 0.9
+
+# Seconds one worker may spend rendering before another may try
+RENDER_LOCK_TIMEOUT = 30
+
+# How long a request waits for another worker's render before rendering itself
+RENDER_WAIT = 10.0
+RENDER_POLL_INTERVAL = 0.05
+
+# Seconds a failed render is remembered, so waiters and repeats give up at once
+RENDER_FAILURE_TIMEOUT = 60
+
+# Waiters look for a remembered failure this often, as it costs a cache read
+RENDER_FAILURE_POLL_INTERVAL = 0.5
+
+CACHE_SIZE_KEY = 'thumbnails:bytes'
+
+# Browser cache lifetime; a thumbnail URL always returns the same bytes
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class UnreadableImage(Exception):
+    """The original is missing or is not an image Pillow can decode"""
+
+
+def is_allowed(spec, extension):
+    return spec in THUMBNAIL_SPECS and extension in THUMBNAIL_FORMATS
+
+
+def thumbnail_key(name, spec, extension):
+    """
+    Stable key for one thumbnail. Originals are named by content hash, so
+    the key changes whenever the image does; it doubles as a strong ETag.
+    """
+    raw = f'{name}:{spec}:{extension}'
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def thumbnail_path(key, extension):
+    return os.path.join(THUMBNAIL_CACHE_DIR, key[:2], f'{key}.{extension}')
+
+
+def _render(name, spec, extension):
+    width, height = (int(edge) for edge in spec.split('x'))
+    _, image_format, options = THUMBNAIL_FORMATS[extension]
+    try:
+        image = ImageOps.fit(_open_rgb(name), (width, height), Image.LANCZOS)
+    except (OSError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError and truncated files are OSErrors
+        raise UnreadableImage(name) from e
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def _write(path, data):
+    # Write beside the target and rename, so readers never see a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as handle:
+        handle.write(data)
+    os.replace(temporary, path)
+
+
+def _touch(path):
+    # Modification time is the recency used for LRU eviction
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _cache_files():
+    for directory, _, files in os.walk(THUMBNAIL_CACHE_DIR):
+        for filename in files:
+            if filename.endswith('.tmp'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+
+def evict_thumbnails(max_bytes=None):
+    """Delete least recently used thumbnails until the cache is under the cap; returns bytes kept"""
+    max_bytes = THUMBNAIL_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    files = sorted(_cache_files())
+    total = sum(size for _, size, _ in files)
+    if total > max_bytes:
+        target = max_bytes * THUMBNAIL_CACHE_LOW_WATER
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+    cache.set(CACHE_SIZE_KEY, total, None)
+    return total
+
+
+def _record_write(size):
+    # The running total is approximate across workers; eviction recounts from disk
+    if cache.add(CACHE_SIZE_KEY, 0, None):
+        total = evict_thumbnails()
+    else:
+        try:
+            total = cache.incr(CACHE_SIZE_KEY, size)
+        except ValueError:
+            total = evict_thumbnails()
+    if total > THUMBNAIL_CACHE_MAX_BYTES:
+        evict_thumbnails()
+
+
+def get_thumbnail(name, spec, extension):
+    """
+    Path of the cached thumbnail of the image stored at name, rendering it
+    on first use. Concurrent requests for the same thumbnail wait for the
+    worker holding the render lock instead of rendering it again. Raises
+    UnreadableImage when the original cannot be rendered.
+    """
+    key = thumbnail_key(name, spec, extension)
+    path = thumbnail_path(key, extension)
+    if _touch(path):
+        return path
+
+    lock_key = f'thumbnails:lock:{key}'
+    failed_key = f'thumbnails:failed:{key}'
+    if cache.get(failed_key):
+        raise UnreadableImage(name)
+
+    token = uuid4().hex
+    locked = cache.add(lock_key, token, RENDER_LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + RENDER_WAIT
+        next_failure_check = time.monotonic() + RENDER_FAILURE_POLL_INTERVAL
+        while time.monotonic() < deadline:
+            time.sleep(RENDER_POLL_INTERVAL)
+            if _touch(path):
+                return path
+            if time.monotonic() >= next_failure_check:
+                if cache.get(failed_key):
+                    raise UnreadableImage(name)
+                next_failure_check = time.monotonic() + RENDER_FAILURE_POLL_INTERVAL
+        # The rendering worker is slow or gone; render without the lock
+
+    try:
+        data = _render(name, spec, extension)
+        _write(path, data)
+    except UnreadableImage:
+        cache.set(failed_key, 1, RENDER_FAILURE_TIMEOUT)
+        raise
+    finally:
+        # The lock may have expired and been taken by another worker
+        if locked and cache.get(lock_key) == token:
+            cache.delete(lock_key)
+    _record_write(len(data))
+    return path
@@ -27,9 +27,12 @@ urlpatterns = [
     path('orders/<int:order_id>/update-status/', views.update_order_status, name='update_order_status'),
     path('orders/<int:order_id>/refund/', views.process_refund, name='process_refund'),
     path('order-detail/<int:order_id>/', views.order_detail, name='order_details'),
+    path('thumbnails/<int:image_id>/<str:spec>.<str:extension>', views.product_thumbnail, name='product_thumbnail'),
 
     path('coupons/', views.manage_coupons, name='manage_coupons'),
     path('coupon-delete/<int:coupon_id>/', views.delete_coupon, name='delete_coupon'),
+    path('coupons/campaigns/', views.manage_campaigns, name='manage_campaigns'),
+    path('coupons/campaigns/<int:campaign_id>/codes.csv', views.campaign_codes_csv, name='campaign_codes_csv'),
 
 
     path('offers/', views.manage_offers, name='manage_offers'),
@@ -10,10 +10,11 @@ from django.contrib.auth.decorators import login_required
 
 from django.contrib import messages
 
-from django.core.paginator import Paginator
+from .pagination import CursorPaginator
+from .thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_MAX_AGE, UnreadableImage, get_thumbnail, is_allowed, thumbnail_key
 from django.db.models import Q
 
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 
 from django.shortcuts import render, redirect, get_object_or_404
 from .models import *
@@ -23,11 +24,14 @@ import os
 from django.core.exceptions import ValidationError
 
 from store.models import *
+from store.pricing import TAX_RATE
+from store.idempotency import idempotent
 
 from django.db import transaction
 
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
 from django.utils import timezone
 from datetime import timedelta
 from decimal import Decimal
@@ -37,9 +41,15 @@ from django.template.loader import get_template
 import openpyxl
 from openpyxl.styles import Font, Alignment, Border, Side
 from django.db.models import Sum, Count
+from django.db.models import DecimalField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 from django.db.models.functions import TruncYear, TruncMonth, TruncWeek, TruncDay
 import json
+import csv
+from itertools import chain
+from django.http import StreamingHttpResponse
+from django.utils.text import slugify
 
 
 
@@ -98,7 +108,7 @@ def admin_dashboard(request):
     # Top 10 best-selling products
     top_products = (OrderItem.objects
                     .filter(order__is_paid=True)
-                    .values('product__name')
+                    .values('product__name', 'product__cover_image')
                     .annotate(total_sold=Sum('quantity'))
                     .order_by('-total_sold')[:10])
 
@@ -145,10 +155,8 @@ def user_list(request):
     if query:
         users = users.filter(Q(username__icontains=query) | Q(email__icontains=query))
 
-    users = users.order_by('-id')  # Latest first
-    paginator = Paginator(users, 5)
-    page = request.GET.get('page')
-    users = paginator.get_page(page)
+    paginator = CursorPaginator(users, ['-id'], 5, count_key=('users', query))  # Latest first
+    users = paginator.get_page(request.GET.get('cursor'))
 
     return render(request, 'back_office/user_list.html', {'users': users, 'query': query})
 
@@ -171,10 +179,8 @@ def category_list(request):
     if query:
         categories = categories.filter(name__icontains=query)
 
-    categories = categories.order_by('-created_at')
-    paginator = Paginator(categories, 5)
-    page = request.GET.get('page')
-    categories = paginator.get_page(page)
+    paginator = CursorPaginator(categories, ['-created_at', '-id'], 5, count_key=('categories', query))
+    categories = paginator.get_page(request.GET.get('cursor'))
 
     return render(request, 'back_office/category_list.html', {'categories': categories, 'query': query})
 
@@ -216,9 +222,8 @@ def product_list(request):
     if query:
         products = products.filter(name__icontains=query)
 
-    paginator = Paginator(products, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(products, ['id'], 10, count_key=('products', query))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     return render(request, 'back_office/product_list.html', {'page_obj': page_obj, 'query':query} )
 
 
@@ -322,12 +327,8 @@ def product_manage(request, product_id=None):
                     id__in=removed_image_ids
                 )
                 
-                # Delete the actual image files from storage (optional)
-                for img in images_to_remove:
-                    if img.image and hasattr(img.image, 'delete'):
-                        img.image.delete(save=False)    
-                
-                # Delete the database records
+                # Delete the database records; files are shared by content
+                # and removed by gc_media once nothing references them
                 images_to_remove.delete()
                 
             except Exception as e:
@@ -343,6 +344,15 @@ def product_manage(request, product_id=None):
                     # Log the error if you have logging set up
                     print(f"Error adding image: {e}")
 
+        # Handle Cover Image: image signals may have replaced it, so reload before saving again
+        product.refresh_from_db(fields=['cover_image'])
+        cover_image_id = request.POST.get('cover_image', '')
+        if cover_image_id.isdigit() and int(cover_image_id) != product.cover_image_id:
+            cover_image = ProductImage.objects.filter(product=product, id=int(cover_image_id)).first()
+            if cover_image:
+                product.cover_image = cover_image
+                product.save()
+
         # Handle Variants
         if use_variants:
             variant_volumes = request.POST.getlist('variant_volume[]')
@@ -519,14 +529,13 @@ def order_list(request):
     # === SORTING ===
     sort_by = request.GET.get('sort')
     if sort_by == 'date_asc':
-        orders = orders.order_by('created_at')
+        ordering = ['created_at', 'id']
     else:  # default or date_desc
-        orders = orders.order_by('-created_at')
+        ordering = ['-created_at', '-id']
 
     # === PAGINATION ===
-    paginator = Paginator(orders, 10)  # 10 orders per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(orders, ordering, 10, count_key=('orders', query, status_filter))  # 10 orders per page
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     context = {
         'orders': page_obj,
@@ -540,10 +549,34 @@ def order_list(request):
 
 def order_detail(request, order_id):
     order = get_object_or_404(
-        Order.objects.prefetch_related('items__product__images', 'items__product__variants'),
+        Order.objects.prefetch_related('items__product__cover_image', 'items__product__variants'),
         id=order_id
     )
-    return render(request, 'back_office/order_detail.html', {'order': order})
+    return render(request, 'back_office/order_detail.html', {'order': order, 'idempotency_key': uuid4().hex})
+
+
+@require_GET
+def product_thumbnail(request, image_id, spec, extension):
+    """Serve a product image at an allow-listed size, rendered once and cached on disk"""
+    if not is_allowed(spec, extension):
+        raise Http404("Unsupported thumbnail size or format")
+    name = ProductImage.objects.filter(pk=image_id).values_list('image', flat=True).first()
+    if not name:
+        raise Http404("Image not found")
+
+    # An image's file never changes, so the key is a strong validator
+    etag = f'"{thumbnail_key(name, spec, extension)}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            thumbnail = open(get_thumbnail(name, spec, extension), 'rb')
+        except (FileNotFoundError, UnreadableImage):
+            raise Http404("Image file missing or unreadable")
+        response = FileResponse(thumbnail, content_type=THUMBNAIL_FORMATS[extension][0])
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={THUMBNAIL_MAX_AGE}, immutable'
+    return response
 
 
 
@@ -570,7 +603,7 @@ def update_order_status(request, order_id):
                 if new_status == 'Returned' and order.is_paid and not order.refund_processed:
                     # For partial return, refund item subtotal + tax on item
                     item_subtotal = item.subtotal()
-                    item_tax = item_subtotal * Decimal('0.05')
+                    item_tax = item_subtotal * TAX_RATE
                     refund_amount = item_subtotal + item_tax
 
                     # Check if this makes the full order returned
@@ -674,7 +707,8 @@ def update_order_status(request, order_id):
 @login_required
 def manage_coupons(request):
     """View to manage coupons (create and edit)"""
-    coupons = Coupon.objects.all()
+    # Campaign codes are listed and exported per campaign instead
+    coupons = Coupon.objects.filter(campaign__isnull=True)
 
     # Check if editing a coupon
     edit_coupon_id = request.GET.get('edit')
@@ -722,6 +756,53 @@ def delete_coupon(request, coupon_id):
     else:
         messages.error(request, "Invalid request method.")
         return redirect('manage_coupons')
+
+
+@staff_member_required(login_url='admin_login')
+def manage_campaigns(request):
+    """Create coupon campaigns with their codes and list campaign stats"""
+    form = CouponCampaignForm(request.POST or None)
+    if request.method == 'POST':
+        if form.is_valid():
+            campaign = form.save()
+            created = campaign.generate_coupons(form.cleaned_data['quantity'])
+            messages.success(request, f"Campaign '{campaign.name}' created with {created} codes!")
+            return redirect('manage_campaigns')
+        messages.error(request, "Please correct the errors below.")
+
+    # Stats for every campaign in one query, grouped on the coupon campaign index
+    revenue = Order.objects.filter(coupon__campaign=OuterRef('pk')).exclude(
+        status__in=['Cancelled', 'Failed']
+    ).values('coupon__campaign').annotate(total=Sum('total_amount')).values('total')
+    campaigns = CouponCampaign.objects.annotate(
+        codes=Count('coupons'),
+        redeemed=Count('coupons', filter=Q(coupons__usage_count__gt=0)),
+        uses=Coalesce(Sum('coupons__usage_count'), 0),
+        revenue=Coalesce(Subquery(revenue), Decimal('0.00'), output_field=DecimalField())
+    )
+    return render(request, 'back_office/manage_campaigns.html', {'form': form, 'campaigns': campaigns})
+
+
+class Echo:
+    """Pseudo-buffer handing csv.writer rows straight back for streaming"""
+    def write(self, value):
+        return value
+
+
+@staff_member_required(login_url='admin_login')
+def campaign_codes_csv(request, campaign_id):
+    """Stream a campaign's codes as CSV without loading them all into memory"""
+    campaign = get_object_or_404(CouponCampaign, id=campaign_id)
+    codes = campaign.coupons.order_by('id').values_list('code', 'usage_count', 'usage_limit', 'valid_until')
+    writer = csv.writer(Echo())
+    rows = chain(
+        [writer.writerow(['Code', 'Times used', 'Usage limit', 'Valid until'])],
+        (writer.writerow(row) for row in codes.iterator(chunk_size=2000))
+    )
+    response = StreamingHttpResponse(rows, content_type='text/csv')
+    filename = slugify(campaign.name) or f'campaign-{campaign.id}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}-codes.csv"'
+    return response
     
 
 def manage_offers(request):
@@ -943,14 +1024,15 @@ def sales_report(request):
 
 @require_POST
 @staff_member_required(login_url='admin_login')
+@idempotent('process_refund')
 def process_refund(request, order_id):
     order = get_object_or_404(Order, id=order_id)
     if order.refund_processed:
-        return JsonResponse({'success': False, 'message': 'Refund already processed'})
+        return JsonResponse({'success': False, 'message': 'Refund already processed'}, status=409)
     if order.payment_method == 'COD' and not order.is_paid:
-        return JsonResponse({'success': False, 'message': 'No refund needed for unpaid COD order'})
+        return JsonResponse({'success': False, 'message': 'No refund needed for unpaid COD order'}, status=400)
     if order.status not in ['Cancelled', 'Returned']:
-        return JsonResponse({'success': False, 'message': 'Refund not applicable for this order'})
+        return JsonResponse({'success': False, 'message': 'Refund not applicable for this order'}, status=400)
 
     try:
         with transaction.atomic():
@@ -971,7 +1053,7 @@ def process_refund(request, order_id):
             return JsonResponse({'success': True, 'message': f'Refunded ₹{refund_amount} to wallet'})
     except Exception as e:
         logger.error(f"Error processing refund for order {order.order_id}: {str(e)}")
-        return JsonResponse({'success': False, 'message': f'Error processing refund: {str(e)}'})
+        return JsonResponse({'success': False, 'message': f'Error processing refund: {str(e)}'}, status=500)
 
 
 
@@ -0,0 +1,45 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import CartItem
+
+
+# Seconds a cached count lives without a cart change; views refresh it on
+# every change and signals drop it when cart rows change elsewhere
+CART_QUANTITY_TIMEOUT = 24 * 60 * 60
+
+
+def _cart_quantity_key(user_id):
+    return f'cart_quantity:{user_id}'
+
+
+def _count_cart_quantity(user_id):
+    return CartItem.objects.filter(cart__user_id=user_id).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+def get_cart_quantity(user_id):
+    """Items in the user's cart, from the cache or one SUM query on a miss"""
+    key = _cart_quantity_key(user_id)
+    total = cache.get(key)
+    if total is None:
+        total = _count_cart_quantity(user_id)
+        cache.set(key, total, CART_QUANTITY_TIMEOUT)
+    return total
+
+
+def refresh_cart_quantity(user_id, total=None):
+    """
+    Recount after the cart changed (unless the caller already summed it)
+    and return the new total. The cached count is replaced once the change
+    commits, so a rolled back change leaves the old count in place.
+    """
+    if total is None:
+        total = _count_cart_quantity(user_id)
+    transaction.on_commit(lambda: cache.set(_cart_quantity_key(user_id), total, CART_QUANTITY_TIMEOUT))
+    return total
+
+
+def forget_cart_quantity(user_id):
+    """Drop the cached count once the current transaction commits, so the next request recounts"""
+    transaction.on_commit(lambda: cache.delete(_cart_quantity_key(user_id)))
@@ -0,0 +1,242 @@
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from back_office.models import ProductVariant
+
+from .cart_counter import refresh_cart_quantity
+from .guest_cart import GUEST_CART_MAX_LINES, guest_cart_item, guest_cart_items
+from .models import Cart, CartItem, WishlistItem
+from .pricing import CartLine, CartPricer
+
+
+MAX_QUANTITY = 10
+
+# Operations accepted by apply_cart_operations
+CART_OPERATIONS = ('set', 'increment', 'remove', 'add')
+
+
+class CartOperationError(Exception):
+    """A batch operation that cannot be applied; nothing in the batch is saved"""
+
+
+def _integer(value, message='Invalid quantity'):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CartOperationError(message)
+
+
+def _check_quantity(item, quantity):
+    if quantity > MAX_QUANTITY:
+        raise CartOperationError(f'Maximum allowed quantity is {MAX_QUANTITY}')
+    if quantity > item.get_stock():
+        raise CartOperationError(f'Only {item.get_stock()} of {item.product.name} available')
+
+
+def _is_available(variant):
+    product = variant.product
+    return not (
+        variant.is_blocked or variant.is_deleted or
+        product.is_blocked or product.is_deleted or
+        product.category.is_blocked or product.category.is_deleted
+    )
+
+
+def _upsert_sql():
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    columns = [CartItem._meta.get_field(name).column for name in ('cart', 'product', 'variant', 'quantity')]
+    cart, product, variant, quantity = (connection.ops.quote_name(column) for column in columns)
+    insert = f"INSERT INTO {table} ({cart}, {product}, {variant}, {quantity}) VALUES (%s, %s, %s, %s)"
+    if connection.vendor == 'mysql':
+        return (
+            f"{insert} ON DUPLICATE KEY UPDATE {quantity} = "
+            f"IF({quantity} + VALUES({quantity}) <= %s, {quantity} + VALUES({quantity}), {quantity})"
+        )
+    return (
+        f"{insert} ON CONFLICT ({cart}, {product}, {variant}) DO UPDATE "
+        f"SET {quantity} = {table}.{quantity} + excluded.{quantity} "
+        f"WHERE {table}.{quantity} + excluded.{quantity} <= %s"
+    )
+
+
+def upsert_cart_line(cart_id, product_id, variant_id, quantity, cap, in_cart=None):
+    """
+    Add quantity to a cart line, creating it if needed, without letting it
+    pass cap; returns whether the quantity was added. Variant lines use one
+    INSERT ... ON DUPLICATE KEY UPDATE (ON CONFLICT elsewhere) with the cap
+    in SQL, so concurrent adds cannot race past it.
+
+    in_cart is the line's quantity when it was read (None if absent). MySQL
+    reports 1 row both for an insert and for a capped no-op, so it tells
+    the two apart; the cap itself never depends on it.
+    """
+    if variant_id is None:
+        # NULL never conflicts in the unique index; serialize on the cart row
+        # instead, taking its lock with a write so SQLite waits rather than fails
+        with transaction.atomic():
+            Cart.objects.filter(pk=cart_id).update(updated_at=timezone.now())
+            lines = CartItem.objects.filter(cart_id=cart_id, product_id=product_id, variant__isnull=True)
+            if lines.filter(quantity__lte=cap - quantity).update(quantity=F('quantity') + quantity):
+                return True
+            if lines.exists():
+                return False
+            CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+            return True
+
+    with connection.cursor() as cursor:
+        cursor.execute(_upsert_sql(), [cart_id, product_id, variant_id, quantity, cap])
+        if connection.vendor == 'mysql':
+            # Affected rows: 1 inserted or unchanged, 2 updated
+            return cursor.rowcount == 2 or (cursor.rowcount == 1 and in_cart is None)
+        return cursor.rowcount == 1
+
+
+def _apply_operations(items, operations, new_item):
+    """
+    Apply operations in memory to items, CartItems with product and variant
+    loaded. new_item(variant) makes the line for an add not yet in the cart.
+    Returns (lines by (product_id, variant_id), changed keys, removed item
+    IDs, IDs of products added).
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError('No operations given')
+
+    items = {item.id: item for item in items}
+    lines = {(item.product_id, item.variant_id): item for item in items.values()}
+
+    variant_ids = [op.get('variant_id') for op in operations if isinstance(op, dict) and op.get('op') == 'add']
+    variants = ProductVariant.objects.select_related('product__category', 'product__cover_image').in_bulk(
+        [_integer(variant_id, 'Invalid variant') for variant_id in variant_ids]
+    ) if variant_ids else {}
+
+    changed, removed, added_products = set(), set(), set()
+    for op in operations:
+        if not isinstance(op, dict) or op.get('op') not in CART_OPERATIONS:
+            raise CartOperationError('Invalid operation')
+
+        if op['op'] == 'add':
+            variant = variants.get(_integer(op.get('variant_id'), 'Invalid variant'))
+            if variant is None or not _is_available(variant):
+                raise CartOperationError('Product variant is unavailable')
+            item = lines.get((variant.product_id, variant.id))
+            if item is None or item.id in removed:
+                item = new_item(variant)
+                removed.discard(item.id)
+                lines[(variant.product_id, variant.id)] = item
+            quantity = item.quantity + _integer(op.get('quantity', 1))
+            added_products.add(variant.product_id)
+        else:
+            item = items.get(_integer(op.get('item_id'), 'Invalid cart item'))
+            if item is None or item.id in removed:
+                raise CartOperationError('Cart item not found')
+            if op['op'] == 'remove':
+                removed.add(item.id)
+                continue
+            if op['op'] == 'set':
+                quantity = _integer(op.get('quantity'))
+            else:
+                quantity = item.quantity + _integer(op.get('by', 1))
+            if quantity == 0 and op['op'] == 'set':
+                removed.add(item.id)
+                continue
+
+        if quantity < 1:
+            raise CartOperationError('Minimum quantity is 1')
+        _check_quantity(item, quantity)
+        item.quantity = quantity
+        changed.add((item.product_id, item.variant_id))
+
+    return lines, changed, removed, added_products
+
+
+def apply_cart_operations(user, operations):
+    """
+    Apply a list of cart operations in one transaction and return the new
+    CartQuote. Each operation is a dict with an "op" of:
+
+        set        item_id, quantity (0 removes the item)
+        increment  item_id, by (default 1; negative to decrement)
+        remove     item_id
+        add        variant_id, quantity (default 1); merges into an existing line
+
+    Operations are applied in order to the cart in memory and then written
+    with one bulk update, one bulk insert and one delete. Any invalid
+    operation raises CartOperationError and the whole batch is rolled back.
+    """
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        # Serialize batches for the same cart
+        cart = Cart.objects.select_for_update().get(pk=cart.pk)
+        pricer = CartPricer(cart)
+        lines, changed, removed, added_products = _apply_operations(
+            pricer.load_items(), operations,
+            lambda variant: CartItem(cart=cart, product=variant.product, variant=variant, quantity=0)
+        )
+
+        updated = [lines[key] for key in changed if lines[key].pk and lines[key].pk not in removed]
+        created = [lines[key] for key in changed if not lines[key].pk]
+        if removed:
+            CartItem.objects.filter(cart=cart, id__in=removed).delete()
+        if updated:
+            CartItem.objects.bulk_update(updated, ['quantity'])
+        if created:
+            CartItem.objects.bulk_create(created)
+        if added_products:
+            WishlistItem.objects.filter(user=user, product_id__in=added_products).delete()
+        refresh_cart_quantity(user.id)
+
+    return pricer.quote()
+
+
+def apply_guest_operations(lines, operations):
+    """
+    Apply cart operations to a guest cart's lines, as decoded from its
+    cookie. Returns the new lines and their CartQuote; nothing is written.
+    """
+    items, _, removed, _ = _apply_operations(
+        guest_cart_items(lines), operations,
+        lambda variant: guest_cart_item(variant.product, variant, 0)
+    )
+    kept = [item for item in items.values() if item.id not in removed]
+    if len(kept) > GUEST_CART_MAX_LINES:
+        raise CartOperationError(f'A cart can hold at most {GUEST_CART_MAX_LINES} products')
+    lines = {(item.product_id, item.variant_id): item.quantity for item in kept}
+    return lines, CartPricer(None).quote(items=kept)
+
+
+def merge_guest_cart(user, lines):
+    """
+    Fold a guest cart into the user's cart with one bulk update and one
+    bulk insert. Quantities add up, capped at stock and MAX_QUANTITY;
+    unavailable lines are dropped.
+    """
+    guest_items = [item for item in guest_cart_items(lines) if CartLine(item, None).available]
+    if not guest_items:
+        return
+
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+        existing = {(item.product_id, item.variant_id): item for item in cart.items.all()}
+
+        updated, created = [], []
+        for guest_item in guest_items:
+            cap = min(guest_item.get_stock(), MAX_QUANTITY)
+            if cap < 1:
+                continue
+            item = existing.get((guest_item.product_id, guest_item.variant_id))
+            if item:
+                item.quantity = max(item.quantity, min(item.quantity + guest_item.quantity, cap))
+                updated.append(item)
+            else:
+                created.append(CartItem(
+                    cart=cart, product=guest_item.product, variant=guest_item.variant,
+                    quantity=min(guest_item.quantity, cap)
+                ))
+
+        if updated:
+            CartItem.objects.bulk_update(updated, ['quantity'])
+        if created:
+            CartItem.objects.bulk_create(created)
+        refresh_cart_quantity(user.id)
@@ -1,10 +1,7 @@
-
-from .models import Cart
+from .cart_counter import get_cart_quantity
 
 def cart_quantity(request):
     total_quantity = 0
     if request.user.is_authenticated:
-        cart = Cart.objects.filter(user=request.user).first()
-        if cart:
-            total_quantity = sum(item.quantity for item in cart.items.all())
-    return {'cart_quantity': total_quantity}
\ No newline at end of file
+        total_quantity = get_cart_quantity(request.user.id)
+    return {'cart_quantity': total_quantity}
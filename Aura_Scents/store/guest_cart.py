@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+from back_office.models import Product, ProductVariant
+
+from .models import CartItem
+
+
+# Signed cookie holding an anonymous visitor's cart; no session or rows are created
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_SALT = 'store.guest_cart'
+
+# Plain cookie with the item count, read by the header script on cached pages
+GUEST_CART_COUNT_COOKIE = 'cart_count'
+
+GUEST_CART_MAX_AGE = int(timedelta(days=30).total_seconds())
+
+# Keeps the cookie well under the 4 KB browser limit
+GUEST_CART_MAX_LINES = 20
+
+
+def decode_guest_cart(value):
+    """'<product>.<variant>.<quantity>|...' -> {(product_id, variant_id or None): quantity}"""
+    lines = {}
+    for entry in value.split('|') if value else []:
+        try:
+            product_id, variant_id, quantity = entry.split('.')
+            key = (int(product_id), int(variant_id) if variant_id else None)
+            quantity = int(quantity)
+        except ValueError:
+            continue
+        if quantity > 0:
+            lines[key] = quantity
+    return lines
+
+
+def encode_guest_cart(lines):
+    return '|'.join(
+        f'{product_id}.{variant_id or ""}.{quantity}'
+        for (product_id, variant_id), quantity in lines.items()
+        if quantity > 0
+    )
+
+
+def load_guest_cart(request):
+    value = request.get_signed_cookie(
+        GUEST_CART_COOKIE, default='', salt=GUEST_CART_SALT, max_age=GUEST_CART_MAX_AGE
+    )
+    return decode_guest_cart(value)
+
+
+def save_guest_cart(response, lines):
+    if not lines:
+        clear_guest_cart(response)
+        return
+    response.set_signed_cookie(
+        GUEST_CART_COOKIE, encode_guest_cart(lines), salt=GUEST_CART_SALT,
+        max_age=GUEST_CART_MAX_AGE, httponly=True, samesite='Lax'
+    )
+    response.set_cookie(
+        GUEST_CART_COUNT_COOKIE, sum(lines.values()), max_age=GUEST_CART_MAX_AGE, samesite='Lax'
+    )
+
+
+def clear_guest_cart(response):
+    response.delete_cookie(GUEST_CART_COOKIE, samesite='Lax')
+    response.delete_cookie(GUEST_CART_COUNT_COOKIE, samesite='Lax')
+
+
+def guest_cart_item(product, variant, quantity):
+    """
+    Unsaved CartItem for a guest line. Its id is the variant ID, or the
+    negated product ID for products without variants, so the cart page can
+    address lines the same way as saved ones.
+    """
+    item = CartItem(product=product, variant=variant, quantity=quantity)
+    item.id = variant.id if variant else -product.id
+    return item
+
+
+def guest_cart_items(lines):
+    """Unsaved CartItems for guest lines, loaded in at most two queries"""
+    variant_ids = [variant_id for _, variant_id in lines if variant_id]
+    product_ids = [product_id for product_id, variant_id in lines if not variant_id]
+    variants = ProductVariant.objects.select_related(
+        'product__category', 'product__cover_image'
+    ).in_bulk(variant_ids) if variant_ids else {}
+    products = Product.objects.select_related(
+        'category', 'cover_image'
+    ).in_bulk(product_ids) if product_ids else {}
+
+    items = []
+    for (product_id, variant_id), quantity in lines.items():
+        variant = variants.get(variant_id) if variant_id else None
+        product = variant.product if variant else products.get(product_id)
+        # Lines for deleted rows, or a variant moved to another product, are dropped
+        if product is None or product.id != product_id or (variant_id and variant is None):
+            continue
+        items.append(guest_cart_item(product, variant, quantity))
+    return items
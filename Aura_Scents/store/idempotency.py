@@ -0,0 +1,126 @@
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+
+# Form field carrying the key when the client cannot set the Idempotency-Key header
+IDEMPOTENCY_FIELD = 'idempotency_key'
+
+# How long keys and their responses are kept; clear_idempotency_keys removes older ones
+IDEMPOTENCY_TTL = timedelta(hours=24)
+
+# How long a first attempt may run before a retry can take its key over;
+# longer than the worker timeout, so only keys of crashed workers are taken
+IDEMPOTENCY_LEASE = timedelta(minutes=2)
+
+FORM_CONTENT_TYPES = ('multipart/form-data', 'application/x-www-form-urlencoded')
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _fingerprint(request):
+    """Digest of what the request asks for, to catch a key reused for another request"""
+    if request.content_type in FORM_CONTENT_TYPES:
+        data = sorted(
+            (name, value) for name, values in request.POST.lists() for value in values
+            if name not in (IDEMPOTENCY_FIELD, 'csrfmiddlewaretoken')
+        )
+    else:
+        data = request.body
+    return _digest(request.method, request.path, data)
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.body), status=record.status_code, content_type=record.content_type)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def retryable(response):
+    """Mark a failed response that is not an error status, so it is not stored"""
+    response.idempotent_retryable = True
+    return response
+
+
+def _reclaim(record, fingerprint):
+    """Take over a key whose first attempt outlived its lease; returns the new claim time"""
+    if record is None or record.status_code is not None:
+        return None
+    if record.created_at > timezone.now() - IDEMPOTENCY_LEASE:
+        return None
+    claimed_at = timezone.now()
+    # Matching the old claim time lets only one retry win
+    taken = IdempotencyKey.objects.filter(key=record.key, status_code__isnull=True, created_at=record.created_at).update(
+        fingerprint=fingerprint, created_at=claimed_at
+    )
+    return claimed_at if taken else None
+
+
+def idempotent(scope, key_func=None):
+    """
+    Make a POST view safe to retry. The client names each attempt with an
+    Idempotency-Key header or idempotency_key field (key_func(request) may
+    derive one instead). The first request with a key runs the view and
+    its response is stored; repeats get that response back without running
+    the view. Error responses and those passed through retryable() are not
+    stored, as their writes were rolled back and the client may try again.
+    A key whose first attempt never finished is freed after IDEMPOTENCY_LEASE.
+    Requests without a key run as usual.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            client_key = None
+            if request.method == 'POST':
+                client_key = (
+                    request.headers.get('Idempotency-Key') or request.POST.get(IDEMPOTENCY_FIELD) or
+                    (key_func(request) if key_func else None)
+                )
+            if not client_key:
+                return view(request, *args, **kwargs)
+
+            key = _digest(scope, request.user.pk or '', client_key)
+            fingerprint = _fingerprint(request)
+            try:
+                # A savepoint, so a taken key does not break an enclosing transaction
+                with transaction.atomic():
+                    claimed_at = IdempotencyKey.objects.create(key=key, fingerprint=fingerprint).created_at
+            except IntegrityError:
+                record = IdempotencyKey.objects.filter(key=key).first()
+                claimed_at = _reclaim(record, fingerprint)
+                if claimed_at is None:
+                    if record is None or record.status_code is None:
+                        return JsonResponse({'error': 'This request is already being processed'}, status=409)
+                    if record.fingerprint != fingerprint:
+                        return JsonResponse({'error': 'This idempotency key was used for a different request'}, status=422)
+                    return _replay(record)
+
+            # Only this attempt's claim is finished, never one that took over from it
+            claim = IdempotencyKey.objects.filter(key=key, created_at=claimed_at)
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                claim.delete()
+                raise
+            if response.status_code >= 400 or response.streaming or getattr(response, 'idempotent_retryable', False):
+                claim.delete()
+            else:
+                claim.update(
+                    status_code=response.status_code,
+                    content_type=response.get('Content-Type', ''),
+                    location=response.get('Location', ''),
+                    body=response.content
+                )
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.idempotency import IDEMPOTENCY_TTL
+from store.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete idempotency keys and their stored responses once they are older than IDEMPOTENCY_TTL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Keys deleted per statement")
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - IDEMPOTENCY_TTL)
+        deleted = 0
+        while True:
+            # Short deletes keep the table writable for requests in flight
+            keys = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            deleted += IdempotencyKey.objects.filter(pk__in=keys).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from back_office.models import Product, ProductVariant
+from store.models import StockReservation
+from store.reservations import fail_unpaid_orders, release_holds
+
+
+class Command(BaseCommand):
+    help = "Release expired stock reservations: checkout holds go back on sale and unpaid Razorpay orders fail"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Reservations, orders or recounted rows handled per transaction")
+        parser.add_argument(
+            '--recount', action='store_true',
+            help="Also recompute reserved counters from the live checkout holds"
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = StockReservation.objects.filter(expires_at__lt=now)
+        batch_size = options['batch_size']
+
+        # Rows locked by a checkout or payment in progress are skipped until the next run
+        hold_ids = list(expired.filter(order__isnull=True).values_list('pk', flat=True))
+        released = 0
+        for start in range(0, len(hold_ids), batch_size):
+            # Checked again under the lock: a checkout may have renewed or ordered the hold meanwhile
+            batch = expired.filter(pk__in=hold_ids[start:start + batch_size], order__isnull=True)
+            released += release_holds(batch, skip_locked=True)
+
+        order_ids = list(expired.filter(order__isnull=False).values_list('order_id', flat=True).distinct())
+        failed = 0
+        for start in range(0, len(order_ids), batch_size):
+            failed += fail_unpaid_orders(order_ids[start:start + batch_size])
+
+        if options['recount']:
+            holds = StockReservation.objects.filter(order__isnull=True)
+            for model, field, extra in (
+                (ProductVariant, 'variant', {}),
+                (Product, 'product', {'variant__isnull': True}),
+            ):
+                held = holds.filter(**{field: OuterRef('pk')}, **extra).values(field).annotate(total=Sum('quantity'))
+                # Primary key ranges keep each UPDATE's row locks short
+                pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+                for start in range(0, len(pks), batch_size):
+                    chunk = pks[start:start + batch_size]
+                    model.objects.filter(pk__gte=chunk[0], pk__lte=chunk[-1]).update(
+                        reserved=Coalesce(Subquery(held.values('total')), Value(0))
+                    )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Released {released} expired checkout holds; failed {failed} unpaid orders."
+        ))
@@ -0,0 +1,20 @@
+from .cart_ops import merge_guest_cart
+from .guest_cart import GUEST_CART_COOKIE, clear_guest_cart, load_guest_cart
+
+
+class GuestCartMiddleware:
+    """
+    Merge a guest cart cookie into the user's cart once they are logged in.
+    Runs on the response, so the login or registration request that
+    authenticated the user merges it, whichever view or provider did so.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if GUEST_CART_COOKIE in request.COOKIES and request.user.is_authenticated:
+            merge_guest_cart(request.user, load_guest_cart(request))
+            clear_guest_cart(response)
+        return response
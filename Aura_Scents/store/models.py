@@ -4,6 +4,8 @@ from back_office.models import *
 import datetime
 from django.utils import timezone
 from decimal import Decimal
+from back_office.identifiers import next_code
+from .pricing import FREE_SHIPPING_THRESHOLD, SHIPPING_FEE, TAX_RATE
 
 class OTP(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -124,12 +126,8 @@ class Order(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.order_id:
-            date_part = timezone.now().strftime("%Y%m%d")
-            random_part = str(random.randint(1000, 9999))
-            self.order_id = f"ORD-{date_part}-{random_part}"
-            while Order.objects.filter(order_id=self.order_id).exists():
-                random_part = str(random.randint(1000, 9999))
-                self.order_id = f"ORD-{date_part}-{random_part}"
+            # ORD-YYYYMMDD-XXXXXXX; the allocator guarantees uniqueness without a lookup
+            self.order_id = f"ORD-{timezone.now().strftime('%Y%m%d')}-{next_code()}"
         super().save(*args, **kwargs)
 
     @property
@@ -146,12 +144,12 @@ class Order(models.Model):
     @property
     def tax(self):
         """Calculate 5% tax on subtotal"""
-        return self.subtotal * Decimal('0.05')
+        return self.subtotal * TAX_RATE
 
     @property
     def shipping_cost(self):
         """Calculate shipping cost (free if subtotal > 1000, else 50)"""
-        return Decimal('0') if self.subtotal > Decimal('1000') else Decimal('50')
+        return Decimal('0') if self.subtotal > FREE_SHIPPING_THRESHOLD else SHIPPING_FEE
 
     @property
     def discount(self):
@@ -170,11 +168,7 @@ class Order(models.Model):
         """Get display name for the applied coupon"""
         if not self.coupon:
             return "Default Discount" if self.subtotal >= Decimal('1500') else None
-        if Referral.objects.filter(referrer_coupon=self.coupon).exists():
-            return "Referral Reward Coupon"
-        if Referral.objects.filter(referred_coupon=self.coupon).exists():
-            return "Welcome Coupon"
-        return "Promo Coupon"
+        return self.coupon.get_kind_display()
 
     class Meta:
         ordering = ['-created_at']
@@ -239,4 +233,40 @@ class WalletTransaction(models.Model):
         ordering = ['-created_at']
 
 
+class StockReservation(models.Model):
+    """
+    Stock set aside for a user until expires_at. Checkout holds (no order)
+    are counted in the product's or variant's reserved column; payment
+    holds keep an unpaid Razorpay order's stock, which the
+    release_reservations sweeper puts back when they expire.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
 
+    def __str__(self):
+        kind = f"order {self.order_id}" if self.order_id else "checkout"
+        return f"{self.quantity} × {self.product_id}/{self.variant_id} for {kind} until {self.expires_at}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A retried write request, identified by a digest of its view, user and
+    client key. status_code stays null while the first attempt runs, which
+    claimed the key at created_at; its response is then kept so repeats can
+    be answered without running it again (see store.idempotency).
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    location = models.CharField(max_length=500, blank=True)
+    body = models.BinaryField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.key[:12]} ({self.status_code or 'in progress'})"
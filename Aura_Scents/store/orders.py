@@ -0,0 +1,113 @@
+from collections import Counter
+
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from back_office.models import Coupon, Product, ProductVariant
+
+from .models import OrderItem, Wallet, WalletTransaction
+
+
+class OrderPlacementError(Exception):
+    """
+    Raised inside an order's transaction when a line, the coupon or the
+    wallet lost a race; the caller's rollback drops the whole order.
+    """
+
+
+def per_row(quantities):
+    """CASE expression picking each row's quantity from {pk: quantity}"""
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=IntegerField()
+    )
+
+
+def take_stock(model, quantities):
+    """
+    Take quantities ({pk: quantity}) off stock with one conditional UPDATE,
+    leaving other users' reservations untouched. Returns False unless every
+    row had enough.
+    """
+    if not quantities:
+        return True
+    enough = Q()
+    for pk, quantity in quantities.items():
+        enough |= Q(pk=pk, stock__gte=F('reserved') + quantity)
+    return model.objects.filter(enough).update(stock=F('stock') - per_row(quantities)) == len(quantities)
+
+
+def return_stock(model, quantities):
+    """Put quantities ({pk: quantity}) back into stock with one UPDATE"""
+    if quantities:
+        model.objects.filter(pk__in=quantities).update(stock=F('stock') + per_row(quantities))
+
+
+def line_quantities(lines):
+    """({variant_id: quantity}, {product_id: quantity}) for anything with product, variant and quantity"""
+    variant_quantities, product_quantities = Counter(), Counter()
+    for line in lines:
+        if line.variant_id:
+            variant_quantities[line.variant_id] += line.quantity
+        product_quantities[line.product_id] += line.quantity
+    return variant_quantities, product_quantities
+
+
+def place_order_lines(order, lines):
+    """
+    Save the order's items with one bulk insert and take their quantities
+    off stock with one conditional UPDATE for variants and one for
+    products, so concurrent checkouts cannot oversell. Must run inside the
+    order's transaction.
+    """
+    variant_quantities, product_quantities = line_quantities(line.item for line in lines)
+    if not (take_stock(ProductVariant, variant_quantities) and take_stock(Product, product_quantities)):
+        raise OrderPlacementError('Sorry, some items in your cart sold out while you were checking out')
+
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=line.item.product,
+            variant=line.item.variant,
+            quantity=line.item.quantity,
+            price=line.discounted_price
+        )
+        for line in lines
+    ])
+
+
+def redeem_coupon(coupon):
+    """Count one use of the coupon unless its usage limit was reached meanwhile"""
+    redeemed = Coupon.objects.filter(
+        Q(usage_limit__isnull=True) | Q(usage_count__lt=F('usage_limit')),
+        pk=coupon.pk
+    ).update(usage_count=F('usage_count') + 1)
+    if not redeemed:
+        raise OrderPlacementError('Coupon is invalid or not applicable.')
+
+
+def debit_wallet(wallet, amount, order):
+    """Pay for the order from the wallet unless its balance dropped below amount"""
+    if wallet is None or not Wallet.objects.filter(pk=wallet.pk, balance__gte=amount).update(
+        balance=F('balance') - amount
+    ):
+        raise OrderPlacementError('Insufficient wallet balance')
+    WalletTransaction.objects.create(
+        wallet=wallet,
+        order=order,
+        transaction_type='debit',
+        amount=amount,
+        description=f'Payment for Order {order.order_id}'
+    )
+
+
+def credit_wallet(user, amount, order, description):
+    """Pay amount into the user's wallet, creating it on first use"""
+    wallet, _ = Wallet.objects.get_or_create(user=user)
+    Wallet.objects.filter(pk=wallet.pk).update(balance=F('balance') + amount)
+    WalletTransaction.objects.create(
+        wallet=wallet,
+        order=order,
+        transaction_type='credit',
+        amount=amount,
+        description=description
+    )
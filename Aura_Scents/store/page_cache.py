@@ -0,0 +1,91 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from back_office.cache_versions import LISTING_VERSION_KEY, get_version
+from back_office.product_cards import refresh_expired_cards
+
+
+# Seconds a rendered page is served before it is rendered again
+PAGE_CACHE_TIMEOUT = 300
+
+# Seconds the last rendered copy is kept to serve while a page is rebuilt
+STALE_PAGE_TIMEOUT = 3600
+
+# Seconds one worker may spend rebuilding a page before another may try
+REBUILD_LOCK_TIMEOUT = 10
+
+# How long a request without a stale copy waits for another worker's rebuild
+REBUILD_WAIT = 2.0
+REBUILD_POLL_INTERVAL = 0.05
+
+
+def _page_key(request):
+    """Cache key from the path and the non-empty GET params in a stable order"""
+    params = sorted(
+        (key, value)
+        for key, values in request.GET.lists()
+        for value in values
+        if value != ''
+    )
+    raw = f'{request.path}?{params}'
+    return 'page:' + hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def _to_response(entry):
+    content, content_type = entry
+    return HttpResponse(content, content_type=content_type)
+
+
+def cache_anonymous_page(view):
+    """
+    Serve a view's rendered output from the cache to anonymous GET requests.
+
+    Pages are keyed on path, normalized query string and the listing version,
+    which is bumped whenever product cards or categories change. When a key
+    is cold only the worker holding the rebuild lock renders it; the others
+    serve the last rendered copy, or wait briefly for the new one.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        # Reprice cards whose offers started or ended so the version moves on
+        refresh_expired_cards()
+        version = get_version(LISTING_VERSION_KEY)
+        page_key = _page_key(request)
+        fresh_key = f'{page_key}:{version}'
+        stale_key = f'{page_key}:stale'
+
+        entry = cache.get(fresh_key)
+        if entry is not None:
+            return _to_response(entry)
+
+        lock_key = f'{fresh_key}:lock'
+        if not cache.add(lock_key, 1, REBUILD_LOCK_TIMEOUT):
+            entry = cache.get(stale_key)
+            deadline = time.monotonic() + REBUILD_WAIT
+            while entry is None and time.monotonic() < deadline:
+                time.sleep(REBUILD_POLL_INTERVAL)
+                entry = cache.get(fresh_key)
+            if entry is not None:
+                return _to_response(entry)
+            # The rebuilding worker is slow or gone; render without caching
+            return view(request, *args, **kwargs)
+
+        try:
+            response = view(request, *args, **kwargs)
+            # Never share responses that set cookies or are not plain pages
+            if response.status_code == 200 and not response.cookies and not response.streaming:
+                entry = (response.content, response['Content-Type'])
+                cache.set(fresh_key, entry, PAGE_CACHE_TIMEOUT)
+                cache.set(stale_key, entry, STALE_PAGE_TIMEOUT)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    return wrapper
@@ -0,0 +1,93 @@
+from decimal import Decimal
+
+from back_office.models import get_best_offers_for_products
+
+
+TAX_RATE = Decimal('0.05')
+FREE_SHIPPING_THRESHOLD = Decimal('1000')
+SHIPPING_FEE = Decimal('50.00')
+
+
+def unit_prices(product, variant, best_offer):
+    """(original, discounted) unit price of a product or variant under an offer"""
+    original_price = variant.price if variant else product.price
+    discounted_price = original_price
+    if best_offer:
+        discounted_price = original_price * (Decimal('1.0') - (best_offer.discount_percentage / Decimal('100.0')))
+    return original_price, discounted_price
+
+
+class CartLine:
+    """One priced cart item"""
+
+    def __init__(self, item, best_offer):
+        self.item = item
+        self.best_offer = best_offer
+        self.original_price, self.discounted_price = unit_prices(item.product, item.variant, best_offer)
+        self.subtotal = self.discounted_price * Decimal(str(item.quantity))
+
+    @property
+    def available(self):
+        product = self.item.product
+        variant = self.item.variant
+        return not (
+            product.is_blocked or product.is_deleted or
+            product.category.is_blocked or product.category.is_deleted or
+            (variant and (variant.is_blocked or variant.is_deleted))
+        )
+
+
+class CartQuote:
+    """
+    Totals for a cart. Only available lines count towards the totals;
+    unavailable ones are kept in unavailable_lines for the caller to
+    show or remove.
+    """
+
+    def __init__(self, lines):
+        self.lines = [line for line in lines if line.available]
+        self.unavailable_lines = [line for line in lines if not line.available]
+        self.subtotal = sum((line.subtotal for line in self.lines), Decimal('0.00'))
+        self.tax = self.subtotal * TAX_RATE
+        self.shipping = Decimal('0.00') if self.subtotal > FREE_SHIPPING_THRESHOLD else SHIPPING_FEE
+        self.discount = Decimal('0.00')
+        self.coupon = None
+
+    @property
+    def total(self):
+        return self.subtotal + self.tax + self.shipping - self.discount
+
+    @property
+    def free_shipping(self):
+        return self.shipping == Decimal('0.00')
+
+    @property
+    def items(self):
+        return [line.item for line in self.lines]
+
+    def apply_coupon(self, coupon):
+        self.coupon = coupon
+        self.discount = coupon.apply_discount(self.subtotal)
+        return self.discount
+
+
+class CartPricer:
+    """
+    Prices a cart with one query for its items, products, categories and
+    variants; offers come from the offer schedule without further queries.
+    """
+
+    def __init__(self, cart):
+        self.cart = cart
+
+    def load_items(self):
+        if self.cart is None:
+            return []
+        return list(
+            self.cart.items.select_related('product__category', 'product__cover_image', 'variant').order_by('id')
+        )
+
+    def quote(self, items=None):
+        items = self.load_items() if items is None else items
+        best_offers = get_best_offers_for_products([item.product for item in items])
+        return CartQuote([CartLine(item, best_offers.get(item.product_id)) for item in items])
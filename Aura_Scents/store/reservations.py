@@ -0,0 +1,164 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from back_office.models import Product, ProductVariant
+
+from .models import Cart, Order, OrderItem, StockReservation
+from .orders import OrderPlacementError, credit_wallet, line_quantities, per_row, return_stock, take_stock
+
+
+# How long checkout holds a cart's stock; every checkout page load renews it
+CHECKOUT_HOLD_TTL = timedelta(minutes=10)
+
+# How long an unpaid Razorpay order keeps its stock
+PAYMENT_HOLD_TTL = timedelta(minutes=30)
+
+# Remark on items of orders failed by the sweeper, so a late payment can restore them
+PAYMENT_EXPIRED_REMARK = 'Payment not received in time'
+
+
+def _reserved_quantities(holds):
+    """
+    ({variant_id: quantity}, {product_id: quantity}) of checkout holds. A
+    hold counts only on the unit it sells, its variant if it has one, so
+    concurrent carts for different sizes never touch the same row.
+    """
+    variant_quantities, product_quantities = Counter(), Counter()
+    for hold in holds:
+        if hold.variant_id:
+            variant_quantities[hold.variant_id] += hold.quantity
+        else:
+            product_quantities[hold.product_id] += hold.quantity
+    return variant_quantities, product_quantities
+
+
+def release_holds(holds, skip_locked=False):
+    """
+    Delete checkout holds and put their units back on sale, with one
+    UPDATE per table. Returns how many holds were released.
+    """
+    with transaction.atomic():
+        holds = list(holds.select_for_update(skip_locked=skip_locked).only('product', 'variant', 'quantity'))
+        if holds:
+            StockReservation.objects.filter(pk__in=[hold.pk for hold in holds]).delete()
+            for model, quantities in zip((ProductVariant, Product), _reserved_quantities(holds)):
+                if quantities:
+                    model.objects.filter(pk__in=quantities).update(reserved=F('reserved') - per_row(quantities))
+    return len(holds)
+
+
+def release_checkout_holds(user):
+    return release_holds(StockReservation.objects.filter(user=user, order__isnull=True))
+
+
+def hold_checkout(user, items):
+    """
+    Hold stock for a user's cart items while they check out and return the
+    items that could not be held. Each hold is one conditional UPDATE on
+    the unit's reserved column; reloading checkout with an unchanged cart
+    only renews the holds' expiry and leaves product rows alone.
+    """
+    now = timezone.now()
+    wanted = Counter()
+    for item in items:
+        wanted[(item.product_id, item.variant_id)] += item.quantity
+
+    with transaction.atomic():
+        # Serialize refreshes for the same user on their cart row
+        Cart.objects.filter(user=user).update(updated_at=now)
+        holds = StockReservation.objects.filter(user=user, order__isnull=True)
+        held = Counter()
+        for product_id, variant_id, quantity in holds.values_list('product_id', 'variant_id', 'quantity'):
+            held[(product_id, variant_id)] += quantity
+        if held == wanted:
+            holds.update(expires_at=now + CHECKOUT_HOLD_TTL)
+            return []
+
+        release_holds(holds)
+        short, created = [], []
+        for item in items:
+            model, pk = (ProductVariant, item.variant_id) if item.variant_id else (Product, item.product_id)
+            if model.objects.filter(pk=pk, stock__gte=F('reserved') + item.quantity).update(
+                reserved=F('reserved') + item.quantity
+            ):
+                created.append(StockReservation(
+                    user=user, product_id=item.product_id, variant_id=item.variant_id,
+                    quantity=item.quantity, expires_at=now + CHECKOUT_HOLD_TTL
+                ))
+            else:
+                short.append(item)
+        StockReservation.objects.bulk_create(created)
+    return short
+
+
+def hold_for_payment(order, lines):
+    """Keep a new Razorpay order's stock until it is paid or PAYMENT_HOLD_TTL passes"""
+    expires_at = timezone.now() + PAYMENT_HOLD_TTL
+    StockReservation.objects.bulk_create([
+        StockReservation(
+            user_id=order.user_id, order=order, product_id=line.item.product_id,
+            variant_id=line.item.variant_id, quantity=line.item.quantity, expires_at=expires_at
+        )
+        for line in lines
+    ])
+
+
+def fail_unpaid_orders(order_ids):
+    """
+    Fail the given orders that are still pending and unpaid: cancel their
+    items and put their stock back. Payment holds of orders paid or
+    cancelled meanwhile are just dropped. Orders locked by a payment being
+    confirmed are skipped for the next run. Returns how many orders failed.
+    """
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update(skip_locked=True).filter(pk__in=order_ids)
+            .values_list('pk', 'is_paid', 'status')
+        )
+        failed = [pk for pk, is_paid, status in orders if not is_paid and status == 'Pending']
+        if failed:
+            items = OrderItem.objects.filter(order_id__in=failed).exclude(status='Cancelled')
+            variant_quantities, product_quantities = line_quantities(items.only('product', 'variant', 'quantity'))
+            return_stock(ProductVariant, variant_quantities)
+            return_stock(Product, product_quantities)
+            items.update(status='Cancelled', remarks=PAYMENT_EXPIRED_REMARK)
+            Order.objects.filter(pk__in=failed).update(status='Failed')
+        StockReservation.objects.filter(order_id__in=[pk for pk, _, _ in orders]).delete()
+    return len(failed)
+
+
+def confirm_payment(order):
+    """
+    Settle a Razorpay order whose payment was verified; call with the order
+    row locked. Its stock is normally still held. If the sweeper failed the
+    order first, the stock is taken again, and when it has sold out since,
+    the payment goes back to the user's wallet. Returns whether the order
+    goes ahead.
+    """
+    if order.is_paid:
+        return order.status != 'Failed'
+    StockReservation.objects.filter(order=order).delete()
+
+    if order.status == 'Failed':
+        items = order.items.filter(remarks=PAYMENT_EXPIRED_REMARK)
+        try:
+            with transaction.atomic():
+                variant_quantities, product_quantities = line_quantities(items)
+                if not (take_stock(ProductVariant, variant_quantities) and take_stock(Product, product_quantities)):
+                    raise OrderPlacementError
+        except OrderPlacementError:
+            credit_wallet(order.user, order.total_amount, order, f"Refund for order {order.order_id} (sold out before payment)")
+            order.is_paid = True
+            order.refund_processed = True
+            order.save()
+            return False
+        items.update(status='Pending', remarks=None)
+
+    order.is_paid = True
+    order.status = 'Processing'
+    order.save()
+    return True
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cart_counter import forget_cart_quantity
+from .models import Cart, CartItem
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_quantity(sender, instance, raw=False, **kwargs):
+    # Catches changes made outside the cart views, such as admin deletes
+    # cascading from a product; the views recount right after their own
+    if raw:
+        return
+    if CartItem.cart.is_cached(instance):
+        user_id = instance.cart.user_id
+    else:
+        user_id = Cart.objects.filter(pk=instance.cart_id).values_list('user_id', flat=True).first()
+    if user_id:
+        forget_cart_quantity(user_id)
+
+
+@receiver(post_delete, sender=Cart)
+def invalidate_deleted_cart_quantity(sender, instance, **kwargs):
+    forget_cart_quantity(instance.user_id)
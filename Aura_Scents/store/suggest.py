@@ -0,0 +1,96 @@
+import bisect
+import threading
+
+from django.urls import reverse
+
+from back_office.cache_versions import CATALOG_VERSION_KEY, get_version
+from back_office.models import Category, Product
+
+
+# Entries scanned per lookup before ranking, so very short prefixes stay cheap
+SUGGEST_SCAN_LIMIT = 200
+
+
+class SuggestIndex:
+    """
+    Per-worker sorted-array prefix index over active product and category names.
+
+    Every word position of a name is indexed, so "amb" completes both
+    "Amber Nights" and "Oud Amber"; matches at the start of the name rank
+    first. Rebuilt lazily when the shared catalog version changes, so lookups
+    in the steady state touch neither the database nor the ORM.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._keys = []
+        self._entries = []
+
+    def _rebuild(self, version):
+        entries = []
+
+        products = Product.objects.filter(
+            is_deleted=False,
+            is_blocked=False,
+            category__is_deleted=False,
+            category__is_blocked=False
+        ).values_list('id', 'name')
+        for product_id, name in products.iterator(chunk_size=2000):
+            item = {'id': product_id, 'name': name, 'url': reverse('product_detail', args=[product_id])}
+            entries.extend(self._entries_for('products', name, item))
+
+        categories = Category.objects.filter(is_deleted=False, is_blocked=False).values_list('id', 'name')
+        for category_id, name in categories:
+            item = {'id': category_id, 'name': name, 'url': f"{reverse('products_page')}?category={category_id}"}
+            entries.extend(self._entries_for('categories', name, item))
+
+        entries.sort(key=lambda entry: entry[0])
+        self._keys = [entry[0] for entry in entries]
+        self._entries = entries
+        self._version = version
+
+    @staticmethod
+    def _entries_for(kind, name, item):
+        words = name.lower().split()
+        for position in range(len(words)):
+            # (key, is_inner_word, kind, item)
+            yield (' '.join(words[position:]), position > 0, kind, item)
+
+    def _refresh(self):
+        version = get_version(CATALOG_VERSION_KEY)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._rebuild(version)
+
+    def suggest(self, prefix, limit):
+        """Return {'products': [...], 'categories': [...]} completions for prefix"""
+        prefix = ' '.join(prefix.lower().split())
+        results = {'products': [], 'categories': []}
+        if not prefix:
+            return results
+        self._refresh()
+
+        keys = self._keys
+        entries = self._entries
+        start = bisect.bisect_left(keys, prefix)
+        end = min(start + SUGGEST_SCAN_LIMIT, len(keys))
+
+        matches = []
+        for index in range(start, end):
+            if not keys[index].startswith(prefix):
+                break
+            matches.append(entries[index])
+        matches.sort(key=lambda entry: (entry[1], entry[3]['name'].lower()))
+
+        seen = set()
+        for _, _, kind, item in matches:
+            if len(results[kind]) >= limit or (kind, item['id']) in seen:
+                continue
+            seen.add((kind, item['id']))
+            results[kind].append(item)
+        return results
+
+
+suggest_index = SuggestIndex()
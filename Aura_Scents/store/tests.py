@@ -1,3 +1,191 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from back_office.models import Category, Product, ProductVariant, User
+from .cart_ops import MAX_QUANTITY, upsert_cart_line
+from .idempotency import IDEMPOTENCY_LEASE, idempotent, retryable
+from .models import Cart, CartItem, IdempotencyKey, Order, StockReservation
+from .orders import OrderPlacementError, place_order_lines
+from .pricing import CartPricer
+from .reservations import hold_checkout
+
+
+class AddToCartConcurrencyTests(TransactionTestCase):
+    """Concurrent adds of one cart line must never pass its cap"""
+
+    threads = 16
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("SQLite's shared in-memory test database rejects concurrent writers")
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret123')
+        category = Category.objects.create(name='Oud')
+        self.product = Product.objects.create(name='Amber Nights', category=category, price=100, stock=50)
+        self.variant = ProductVariant.objects.create(product=self.product, volume=50, unit='ml', price=100, stock=50)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def hammer(self, variant_id, cap):
+        barrier = threading.Barrier(self.threads)
+        results, errors = [], []
+
+        def add():
+            try:
+                barrier.wait()
+                results.append(upsert_cart_line(self.cart.id, self.product.id, variant_id, 1, cap=cap))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=add) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_variant_line_stops_at_cap(self):
+        results = self.hammer(self.variant.id, MAX_QUANTITY)
+
+        lines = CartItem.objects.filter(cart=self.cart, product=self.product, variant=self.variant)
+        self.assertEqual(lines.count(), 1)
+        self.assertEqual(lines.get().quantity, MAX_QUANTITY)
+        self.assertEqual(results.count(True), MAX_QUANTITY)
+
+    def test_line_without_variant_stops_at_cap(self):
+        results = self.hammer(None, 5)
+
+        lines = CartItem.objects.filter(cart=self.cart, product=self.product, variant__isnull=True)
+        self.assertEqual(lines.count(), 1)
+        self.assertEqual(lines.get().quantity, 5)
+        self.assertEqual(results.count(True), 5)
+
+
+class PlaceOrderLinesTests(TestCase):
+    """Order lines take stock with conditional updates and fail as a whole"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='buyer@example.com', username='buyer', password='secret123')
+        category = Category.objects.create(name='Oud')
+        self.product = Product.objects.create(name='Amber Nights', category=category, price=100, stock=8)
+        self.large = ProductVariant.objects.create(product=self.product, volume=100, unit='ml', price=150, stock=5)
+        self.small = ProductVariant.objects.create(product=self.product, volume=50, unit='ml', price=100, stock=3)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def place(self, large, small):
+        CartItem.objects.create(cart=self.cart, product=self.product, variant=self.large, quantity=large)
+        CartItem.objects.create(cart=self.cart, product=self.product, variant=self.small, quantity=small)
+        lines = CartPricer(self.cart).quote().lines
+        with transaction.atomic():
+            order = Order.objects.create(user=self.user, total_amount=0)
+            place_order_lines(order, lines)
+        return order
+
+    def stock(self):
+        self.product.refresh_from_db()
+        self.large.refresh_from_db()
+        self.small.refresh_from_db()
+        return self.product.stock, self.large.stock, self.small.stock
+
+    def test_takes_stock_from_variants_and_product(self):
+        order = self.place(large=2, small=3)
+
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(self.stock(), (3, 3, 0))
+
+    def test_short_line_rolls_back_the_order(self):
+        with self.assertRaises(OrderPlacementError):
+            self.place(large=2, small=4)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), (8, 5, 3))
+
+
+class StockReservationTests(TestCase):
+    """Checkout holds set stock aside for one user until they expire"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Oud')
+        self.product = Product.objects.create(name='Amber Nights', category=category, price=100, stock=5)
+        self.variant = ProductVariant.objects.create(product=self.product, volume=50, unit='ml', price=100, stock=5)
+        self.holder = self.cart_for('holder', 3)
+        self.buyer = self.cart_for('buyer', 3)
+
+    def cart_for(self, name, quantity):
+        user = User.objects.create_user(email=f'{name}@example.com', username=name, password='secret123')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.product, variant=self.variant, quantity=quantity)
+        return cart
+
+    def test_held_stock_cannot_be_ordered_by_others(self):
+        self.assertEqual(hold_checkout(self.holder.user, list(self.holder.items.all())), [])
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.available_stock, 2)
+
+        with self.assertRaises(OrderPlacementError), transaction.atomic():
+            order = Order.objects.create(user=self.buyer.user, total_amount=0)
+            place_order_lines(order, CartPricer(self.buyer).quote().lines)
+
+    def test_expired_holds_are_released(self):
+        hold_checkout(self.holder.user, list(self.holder.items.all()))
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        call_command('release_reservations', stdout=StringIO())
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class IdempotencyTests(TestCase):
+    """Retries of a keyed POST replay its outcome, but never a failure or a dead attempt"""
+
+    def setUp(self):
+        self.calls = []
+
+        @idempotent('test')
+        def view(request):
+            self.calls.append(request)
+            if request.POST.get('fail'):
+                return retryable(HttpResponse('try again', status=302))
+            return HttpResponse('done', status=201)
+
+        self.view = view
+
+    def post(self, **data):
+        request = RequestFactory().post('/', data, HTTP_IDEMPOTENCY_KEY='attempt-1')
+        request.user = AnonymousUser()
+        return self.view(request)
+
+    def test_repeat_replays_the_stored_response(self):
+        self.assertEqual(self.post().status_code, 201)
+        response = self.post()
+
+        self.assertEqual((response.status_code, response.content), (201, b'done'))
+        self.assertEqual(len(self.calls), 1)
+
+    def test_retryable_response_is_not_stored(self):
+        self.post(fail='1')
+        self.post(fail='1')
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_attempt_past_its_lease_is_taken_over(self):
+        self.post()
+        IdempotencyKey.objects.update(status_code=None)
+        self.assertEqual(self.post().status_code, 409)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - IDEMPOTENCY_LEASE - timedelta(seconds=1))
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('', views.home_page, name='home_page'),
     path('products', views.products_page, name='products_page'),
+    path('search/suggest/', views.search_suggest, name='search_suggest'),
     path('product/<int:product_id>/', views.product_detail_view, name='product_detail'),
     
     path('toggle-wishlist/<int:product_id>/', views.toggle_wishlist, name='toggle_wishlist'),
@@ -36,6 +37,7 @@ urlpatterns = [
     path('update-cart/<int:item_id>/', views.update_cart, name='update_cart'),  
     path('remove-from-cart/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),  
     path('clear-cart/', views.clear_cart, name='clear_cart'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
 
     path('checkout/', views.checkout, name='checkout'),
     path('payment-handler/', views.payment_handler, name='payment_handler'),
@@ -1,7 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from back_office.models import *
-from django.core.paginator import Paginator
-from django.db.models import Q,Prefetch
+from back_office.pagination import CursorPaginator
+from django.db.models import Q,OuterRef,Subquery,Sum
 
 from django.contrib import messages
 
@@ -11,6 +11,7 @@ from .forms import *
 from .models import *
 
 import random
+from uuid import uuid4
 
 from django.core.mail import send_mail
 from django.conf import settings
@@ -27,7 +28,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
 import json
 
-from decimal import Decimal,ROUND_HALF_UP
+from decimal import Decimal,ROUND_HALF_UP,InvalidOperation
 
 from django.template.loader import render_to_string
 
@@ -36,7 +37,6 @@ from django.contrib.auth import authenticate, update_session_auth_hash
 
 from django.views.decorators.http import require_http_methods
 
-import os
 
 from django.utils import timezone
 
@@ -52,98 +52,52 @@ from razorpay.errors import SignatureVerificationError
 
 from django.db import transaction
 
+from back_office.product_cards import listed_cards
+from back_office.search import search_paginator
+from .page_cache import cache_anonymous_page
+from .suggest import suggest_index
+from .cart_counter import refresh_cart_quantity
+from .pricing import CartPricer, unit_prices
+from .cart_ops import MAX_QUANTITY, CartOperationError, apply_cart_operations, apply_guest_operations, upsert_cart_line
+from .orders import OrderPlacementError, debit_wallet, place_order_lines, redeem_coupon
+from .idempotency import idempotent, retryable
+from .reservations import confirm_payment, fail_unpaid_orders, hold_checkout, hold_for_payment, release_checkout_holds
+from .guest_cart import GUEST_CART_MAX_LINES, clear_guest_cart, guest_cart_items, load_guest_cart, save_guest_cart
+
 # Forgot Password Import
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 
+import logging
 
+logger = logging.getLogger(__name__)
 
+
+@cache_anonymous_page
 def home_page(request):
-    # Get latest products with prefetch_related for efficiency
-    latest_products = Product.objects.filter(
-        is_deleted=False,
-        is_blocked=False
-    ).prefetch_related('variants').order_by('-created_at')[:4]
-    
-    # Add display_price to each product
-    for product in latest_products:
-        # Get active variants (not deleted and not blocked)
-        active_variants = product.variants.filter(
-            is_deleted=False,
-            is_blocked=False
-        ).order_by('created_at')
-        
-        if active_variants.exists():
-            # If product has variants, use the first variant's price
-            product.display_price = active_variants.first().price
-        else:
-            # If no variants, use the base product price
-            product.display_price = product.price
-    
+    # Latest products straight from the card table
+    latest_products = listed_cards().order_by('-created_at')[:4]
+
     return render(request, 'store/home_page.html', { 
         'latest_products': latest_products 
     })
 
 
+@cache_anonymous_page
 def products_page(request):
-    # Base queryset with prefetch for variants, images, and offers
-    products = Product.objects.filter(
-        is_blocked=False,
-        is_deleted=False
-    ).prefetch_related(
-        Prefetch(
-            'variants',
-            queryset=ProductVariant.objects.filter(
-                is_deleted=False,
-                is_blocked=False
-            ).order_by('created_at')
-        ),
-        'images',
-        Prefetch(
-            'offers',
-            queryset=ProductOffer.objects.select_related('offer')
-        ),
-        Prefetch(
-            'category__offers',
-            queryset=CategoryOffer.objects.select_related('offer')
-        )
-    )
+    # Base queryset of product cards; prices and offers are precomputed
+    products = listed_cards()
 
     categories = Category.objects.filter(is_deleted=False, is_blocked=False)
 
-    # --- Search ---
     query = request.GET.get('q', '')
-    if query:
-        products = products.filter(Q(name__icontains=query) | Q(description__icontains=query))
 
     # --- Filter by Category ---
     category_id = request.GET.get('category')
     if category_id and category_id.isdigit():
         products = products.filter(category_id=int(category_id))
 
-    # Convert to list to add display_price and offer attributes
-    products_list = list(products)
-
-    # Add display_price and offer details to each product
-    for product in products_list:
-        # Get base price (from variant or product)
-        first_variant = product.variants.first()
-        product.display_price = first_variant.price if first_variant else product.price
-        
-        # Get best offer and calculate discounted price
-        best_offer = get_best_offer_for_product(product)
-        product.best_offer = best_offer
-        if best_offer and best_offer.is_valid():
-            discount_multiplier = Decimal('1.0') - (best_offer.discount_percentage / Decimal('100.0'))
-            product.discounted_price = product.display_price * discount_multiplier
-            product.discount_percentage = best_offer.discount_percentage
-            product.offer_type = best_offer.offer_type
-        else:
-            product.discounted_price = None
-            product.discount_percentage = None
-            product.offer_type = None
-
     # --- Filter by Price Range (Radio Button) ---
     price_range = request.GET.get('price_range', '')
     min_price, max_price = None, None
@@ -151,36 +105,40 @@ def products_page(request):
     if price_range:
         if '-' in price_range:
             parts = price_range.split('-')
-            if parts[0]:
-                min_price = parts[0]
-                # Filter by discounted_price if available, else display_price
-                products_list = [
-                    p for p in products_list 
-                    if (p.discounted_price or p.display_price) >= float(min_price)
-                ]
-            if len(parts) > 1 and parts[1]:
-                max_price = parts[1]
-                # Filter by discounted_price if available, else display_price
-                products_list = [
-                    p for p in products_list 
-                    if (p.discounted_price or p.display_price) <= float(max_price)
-                ]
+            try:
+                if parts[0]:
+                    min_price = parts[0]
+                    # Filter on the offer-adjusted price
+                    products = products.filter(effective_price__gte=Decimal(min_price))
+                if len(parts) > 1 and parts[1]:
+                    max_price = parts[1]
+                    products = products.filter(effective_price__lte=Decimal(max_price))
+            except InvalidOperation:
+                pass  # Invalid format, ignore
 
     # --- Sorting ---
     sort_by = request.GET.get('sort')
     if sort_by == 'price_asc':
-        products_list.sort(key=lambda x: x.discounted_price or x.display_price)
+        ordering = ['effective_price', 'pk']
     elif sort_by == 'price_desc':
-        products_list.sort(key=lambda x: x.discounted_price or x.display_price, reverse=True)
+        ordering = ['-effective_price', 'pk']
     elif sort_by == 'name_asc':
-        products_list.sort(key=lambda x: x.name)
+        ordering = ['name', 'pk']
     elif sort_by == 'name_desc':
-        products_list.sort(key=lambda x: x.name, reverse=True)
+        ordering = ['-name', 'pk']
+    elif query:
+        ordering = ['-search_rank', 'pk']
+    else:
+        ordering = ['pk']
 
     # --- Pagination ---
-    paginator = Paginator(products_list, 5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    count_key = ('listed_products', query, category_id, min_price, max_price)
+    if query:
+        # Ranked full-text search over name, description and category name
+        paginator = search_paginator(products, query, ordering, 5, count_key=count_key)
+    else:
+        paginator = CursorPaginator(products, ordering, 5, count_key=count_key)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     # --- Wishlist ---
     wishlist_product_ids = []
@@ -200,6 +158,18 @@ def products_page(request):
     }
     return render(request, 'store/products_page.html', context)
 
+# Search suggestions
+SUGGEST_DEFAULT_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+
+def search_suggest(request):
+    prefix = request.GET.get('q', '')[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', SUGGEST_DEFAULT_LIMIT)), 1), SUGGEST_MAX_LIMIT)
+    except ValueError:
+        limit = SUGGEST_DEFAULT_LIMIT
+    return JsonResponse(suggest_index.suggest(prefix, limit))
+
 def product_detail_view(request, product_id):
     try:
         product = Product.objects.prefetch_related('images', 'variants').get(pk=product_id)
@@ -219,10 +189,10 @@ def product_detail_view(request, product_id):
     default_variant = None
     if available_variants.exists():
         default_variant = available_variants.first()
-        current_stock = default_variant.stock
+        current_stock = default_variant.available_stock
         current_price = default_variant.price
     else:
-        current_stock = product.stock
+        current_stock = product.available_stock
         current_price = product.price
 
     # Stock status
@@ -231,6 +201,9 @@ def product_detail_view(request, product_id):
     else:
         stock_status = f"In Stock: {current_stock}"
 
+    # Related products come precomputed from the card table
+    related_products = listed_cards().filter(category_id=product.category_id).exclude(pk=product.id)[:4]
+
     # Get best offer for the product
     best_offer = get_best_offer_for_product(product)
     original_price = current_price
@@ -250,26 +223,6 @@ def product_detail_view(request, product_id):
             'discounted_price': variant_discounted_price
         })
 
-    # Related products with discounted prices
-    related_products = (
-        Product.objects
-        .filter(category=product.category, is_blocked=False, is_deleted=False)
-        .exclude(id=product.id)[:4]
-    )
-    related_products_data = []
-    for related in related_products:
-        related_best_offer = get_best_offer_for_product(related)
-        related_original_price = related.price
-        related_discounted_price = related.price
-        if related_best_offer:
-            related_discounted_price = related.price * (Decimal('1.0') - (related_best_offer.discount_percentage / Decimal('100.0')))
-        related_products_data.append({
-            'product': related,
-            'original_price': related_original_price,
-            'discounted_price': related_discounted_price,
-            'best_offer': related_best_offer
-        })
-
     # Check if product is already in user's wishlist
     in_wishlist = False
     if request.user.is_authenticated:
@@ -286,7 +239,7 @@ def product_detail_view(request, product_id):
         'current_stock': current_stock,
         'breadcrumbs': [product.category.name, product.name],
         'stock_status': stock_status,
-        'related_products': related_products_data,
+        'related_products': related_products,
         'in_wishlist': in_wishlist,
     }
 
@@ -330,28 +283,31 @@ def toggle_wishlist(request, product_id, variant_id=None):
 
 @login_required
 def wishlist(request):
-    wishlist_items = WishlistItem.objects.filter(user=request.user).select_related('product', 'variant')
+    wishlist_items = list(WishlistItem.objects.filter(user=request.user).select_related('variant'))
+    cards = listed_cards().in_bulk([item.product_id for item in wishlist_items])
     wishlist_data = []
     for item in wishlist_items:
-        if item.product.is_blocked or item.product.is_deleted or (item.variant and (item.variant.is_blocked or item.variant.is_deleted)):
+        card = cards.get(item.product_id)
+        if card is None or (item.variant and (item.variant.is_blocked or item.variant.is_deleted)):
             continue
 
-        # Get price (variant price if exists, else product price)
-        original_price = item.variant.price if item.variant else item.product.price
+        # Get price (variant price if exists, else the card's display price)
+        original_price = item.variant.price if item.variant else card.display_price
 
-        # Get best offer for the product
-        best_offer = get_best_offer_for_product(item.product)
         discounted_price = original_price
-        if best_offer:
-            discounted_price = original_price * (Decimal('1.0') - (best_offer.discount_percentage / Decimal('100.0')))
+        if card.best_discount:
+            discounted_price = original_price * (Decimal('1.0') - (card.best_discount / Decimal('100.0')))
+
+        display_name = card.name
+        if item.variant:
+            display_name = f"{card.name} ({item.variant.volume}{item.variant.unit})"
 
         wishlist_data.append({
-            'product': item.product,
+            'card': card,
             'variant': item.variant,
             'original_price': original_price,
             'discounted_price': discounted_price,
-            'best_offer': best_offer,
-            'display_name': item.get_display_name()
+            'display_name': display_name
         })
 
     context = {
@@ -561,10 +517,7 @@ def profile_edit(request):
         # Handle image deletion
         if 'delete_image' in request.POST:
             if user.profile_image:
-                # Delete the file from storage
-                if os.path.exists(user.profile_image.path):
-                    os.remove(user.profile_image.path)
-                # Clear the field
+                # The file may be shared; gc_media removes it once unreferenced
                 user.profile_image = None
                 user.save()
                 messages.success(request, 'Profile image deleted successfully.')
@@ -696,51 +649,39 @@ def address_delete(request, pk):
     return redirect('address_list')
 
 # Cart View
-def cart_view(request):
-    cart = None
-    items = []
-    cart_total = Decimal('0.00')
-
+def _current_quote(request):
+    """Quote for the user's cart, or for the guest cart cookie of an anonymous visitor"""
     if request.user.is_authenticated:
-        cart = Cart.objects.filter(user=request.user).first()
-        if cart:
-            items = cart.items.select_related('product', 'variant')
-            cart_data = []
-            for item in items:
-                # Get price (variant price if exists, else product price)
-                original_price = item.variant.price if item.variant else item.product.price
-                # Get best offer for the product
-                best_offer = get_best_offer_for_product(item.product)
-                discounted_price = original_price
-                if best_offer:
-                    discounted_price = original_price * (Decimal('1.0') - (best_offer.discount_percentage / Decimal('100.0')))
-                # Calculate subtotal based on discounted price
-                subtotal = discounted_price * Decimal(str(item.quantity))
-                cart_data.append({
-                    'item': item,
-                    'original_price': original_price,
-                    'discounted_price': discounted_price,
-                    'best_offer': best_offer,
-                    'subtotal': subtotal
-                })
-            cart_total = sum(item['subtotal'] for item in cart_data)
-            items = cart_data
+        return CartPricer(Cart.objects.filter(user=request.user).first()).quote()
+    return CartPricer(None).quote(items=guest_cart_items(load_guest_cart(request)))
+
+def cart_view(request):
+    quote = _current_quote(request)
 
     context = {
-        'cart': cart,
-        'items': items,
-        'cart_total': cart_total,
+        'items': quote.lines,
+        'unavailable_items': quote.unavailable_lines,
+        'cart_total': quote.subtotal,
+        'max_quantity': MAX_QUANTITY,
     }
     return render(request, 'store/cart.html', context)
 
 # Add to Cart
-MAX_QUANTITY = 10
 @csrf_exempt
 def add_to_cart(request, product_id):
-    if not request.user.is_authenticated:
-        return JsonResponse({'status': 'error', 'message': 'Login required'}, status=401)
-
-    product = get_object_or_404(Product, id=product_id)
+    # Product, category, variants and what is already in the cart in one read
+    in_cart = CartItem.objects.filter(
+        cart__user_id=request.user.id, product_id=OuterRef('product_id'), variant_id=OuterRef('pk')
+    ).values('quantity')[:1]
+    variants = list(
+        ProductVariant.objects.select_related('product__category')
+        .filter(product_id=product_id)
+        .annotate(in_cart=Subquery(in_cart))
+        .order_by('pk')
+    )
+    product = variants[0].product if variants else get_object_or_404(
+        Product.objects.select_related('category'), id=product_id
+    )
 
     # Check if product is available
     if product.is_blocked or product.is_deleted or product.category.is_blocked or product.category.is_deleted:
@@ -751,20 +692,19 @@ def add_to_cart(request, product_id):
     variant = None
 
     # If product has variants but no variant was specified, use the first available variant
-    if product.variants.exists() and not variant_id:
-        variant = product.variants.filter(is_blocked=False, is_deleted=False).first()
+    if variants and not variant_id:
+        variant = next((v for v in variants if not v.is_blocked and not v.is_deleted), None)
         if not variant:
             return JsonResponse({'status': 'error', 'message': 'No available variants for this product'}, status=400)
     elif variant_id:
-        try:
-            variant = ProductVariant.objects.get(id=variant_id, product=product)
-            if variant.is_blocked or variant.is_deleted:
-                return JsonResponse({'status': 'error', 'message': 'Product variant is unavailable'}, status=400)
-        except ProductVariant.DoesNotExist:
+        variant = next((v for v in variants if str(v.pk) == variant_id), None)
+        if not variant:
             return JsonResponse({'status': 'error', 'message': 'Invalid variant selected'}, status=400)
+        if variant.is_blocked or variant.is_deleted:
+            return JsonResponse({'status': 'error', 'message': 'Product variant is unavailable'}, status=400)
 
     # Check stock availability
-    available_stock = variant.stock if variant else product.stock
+    available_stock = variant.available_stock if variant else product.available_stock
     if available_stock == 0:
         return JsonResponse({'status': 'error', 'message': 'Out of stock'}, status=400)
 
@@ -779,36 +719,54 @@ def add_to_cart(request, product_id):
     if quantity > available_stock:
         return JsonResponse({'status': 'error', 'message': 'Quantity exceeds available stock'}, status=400)
 
-    # Get or create cart
-    cart, _ = Cart.objects.get_or_create(user=request.user)
-
-    # Get or create cart item with variant consideration
-    cart_item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-        variant=variant,
-        defaults={'quantity': 0}
-    )
+    # Get best offer and discounted price
+    best_offer = get_best_offer_for_product(product)
+    original_price, discounted_price = unit_prices(product, variant, best_offer)
+    price_data = {
+        'item_price': str(discounted_price),  # Return discounted price
+        'original_price': str(original_price),
+        'discount_percentage': best_offer.discount_percentage if best_offer else None,
+        'offer_type': best_offer.get_offer_type_display() if best_offer else None
+    }
 
-    if not created:
-        new_quantity = cart_item.quantity + quantity
+    # Guests keep their cart in a signed cookie until they log in
+    if not request.user.is_authenticated:
+        lines = load_guest_cart(request)
+        key = (product.id, variant.id if variant else None)
+        new_quantity = lines.get(key, 0) + quantity
         if new_quantity > available_stock or new_quantity > MAX_QUANTITY:
             return JsonResponse({'status': 'error', 'message': 'Quantity exceeds available stock or limit'}, status=400)
-        cart_item.quantity = new_quantity
-    else:
-        cart_item.quantity = quantity
+        if key not in lines and len(lines) >= GUEST_CART_MAX_LINES:
+            return JsonResponse({'status': 'error', 'message': f'A cart can hold at most {GUEST_CART_MAX_LINES} products'}, status=400)
+        lines[key] = new_quantity
+        response = JsonResponse({
+            'status': 'success',
+            'message': 'Added to cart',
+            'cart_quantity': sum(lines.values()),
+            'line_quantity': new_quantity,
+            **price_data
+        })
+        save_guest_cart(response, lines)
+        return response
 
-    cart_item.save()
+    # Get or create cart
+    cart, _ = Cart.objects.get_or_create(user=request.user)
 
-    # Calculate updated cart quantity
-    total_quantity = sum(item.quantity for item in cart.items.all())
+    # Upsert the line; the stock and per-user caps are enforced in SQL
+    added = upsert_cart_line(
+        cart.id, product.id, variant.id if variant else None, quantity,
+        cap=min(available_stock, MAX_QUANTITY),
+        in_cart=variant.in_cart if variant else None
+    )
+    if not added:
+        return JsonResponse({'status': 'error', 'message': 'Quantity exceeds available stock or limit'}, status=400)
 
-    # Get best offer and discounted price
-    original_price = variant.price if variant else product.price
-    best_offer = get_best_offer_for_product(product)
-    discounted_price = original_price
-    if best_offer:
-        discounted_price = original_price * (Decimal('1.0') - (best_offer.discount_percentage / Decimal('100.0')))
+    # New totals from one aggregate rather than the whole cart
+    totals = CartItem.objects.filter(cart=cart).aggregate(
+        cart_quantity=Sum('quantity'),
+        line_quantity=Sum('quantity', filter=Q(product=product, variant=variant))
+    )
+    total_quantity = refresh_cart_quantity(request.user.id, totals['cart_quantity'])
 
     # Remove from wishlist if exists
     WishlistItem.objects.filter(user=request.user, product=product).delete()
@@ -817,10 +775,8 @@ def add_to_cart(request, product_id):
         'status': 'success',
         'message': 'Added to cart',
         'cart_quantity': total_quantity,
-        'item_price': str(discounted_price),  # Return discounted price
-        'original_price': str(original_price),
-        'discount_percentage': best_offer.discount_percentage if best_offer else None,
-        'offer_type': best_offer.get_offer_type_display() if best_offer else None
+        'line_quantity': totals['line_quantity'],
+        **price_data
     })
 
 @csrf_exempt
@@ -837,7 +793,7 @@ def update_cart(request, item_id):
         
         # Get cart and cart item
         cart = Cart.objects.get(user=request.user)
-        cart_item = CartItem.objects.get(id=item_id, cart=cart)
+        cart_item = CartItem.objects.select_related('product', 'variant').get(id=item_id, cart=cart)
         
         # Check if product/variant is still available
         if cart_item.product.is_blocked or cart_item.product.is_deleted:
@@ -849,11 +805,8 @@ def update_cart(request, item_id):
         available_stock = cart_item.get_stock()
 
         # Get price and apply best offer
-        original_price = cart_item.variant.price if cart_item.variant else cart_item.product.price
         best_offer = get_best_offer_for_product(cart_item.product)
-        discounted_price = original_price
-        if best_offer:
-            discounted_price = original_price * (Decimal('1.0') - (best_offer.discount_percentage / Decimal('100.0')))
+        original_price, discounted_price = unit_prices(cart_item.product, cart_item.variant, best_offer)
 
         if action == 'increment':
             if cart_item.quantity >= available_stock:
@@ -863,11 +816,13 @@ def update_cart(request, item_id):
             else:
                 cart_item.quantity += 1
                 cart_item.save()
+                cart_quantity = refresh_cart_quantity(request.user.id)
                 new_subtotal = discounted_price * Decimal(str(cart_item.quantity))
                 return JsonResponse({
                     'status': 'success', 
                     'message': 'Quantity increased',
                     'new_quantity': cart_item.quantity,
+                    'cart_quantity': cart_quantity,
                     'new_subtotal': float(new_subtotal),
                     'discounted_price': float(discounted_price),
                     'original_price': float(original_price),
@@ -879,11 +834,13 @@ def update_cart(request, item_id):
             if cart_item.quantity > 1:
                 cart_item.quantity -= 1
                 cart_item.save()
+                cart_quantity = refresh_cart_quantity(request.user.id)
                 new_subtotal = discounted_price * Decimal(str(cart_item.quantity))
                 return JsonResponse({
                     'status': 'success', 
                     'message': 'Quantity decreased',
                     'new_quantity': cart_item.quantity,
+                    'cart_quantity': cart_quantity,
                     'new_subtotal': float(new_subtotal),
                     'discounted_price': float(discounted_price),
                     'original_price': float(original_price),
@@ -902,7 +859,7 @@ def update_cart(request, item_id):
     except json.JSONDecodeError:
         return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
     except Exception as e:
-        print(f"Error in update_cart: {str(e)}")  # For debugging
+        logger.error(f"Error in update_cart: {str(e)}")
         return JsonResponse({'status': 'error', 'message': 'An unexpected error occurred'}, status=500)
 
 
@@ -914,31 +871,88 @@ def remove_from_cart(request, item_id):
         cart = Cart.objects.get(user=request.user)
         cart_item = CartItem.objects.get(id=item_id, cart=cart)
         cart_item.delete()
-        return JsonResponse({'status': 'success', 'message': 'Removed from cart'})
+        return JsonResponse({
+            'status': 'success',
+            'message': 'Removed from cart',
+            'cart_quantity': refresh_cart_quantity(request.user.id)
+        })
     except Cart.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Cart not found'}, status=404)
     except CartItem.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Cart item not found'}, status=404)
     except Exception as e:
-        print(f"Error in remove_from_cart: {str(e)}")  # For debugging
+        logger.error(f"Error in remove_from_cart: {str(e)}")
         return JsonResponse({'status': 'error', 'message': 'An unexpected error occurred'}, status=500)
 
 
 @csrf_exempt
-@login_required
 @require_POST
 def clear_cart(request):
+    if not request.user.is_authenticated:
+        response = JsonResponse({'status': 'success', 'message': 'Cart cleared successfully', 'cart_quantity': 0})
+        clear_guest_cart(response)
+        return response
     try:
         cart = Cart.objects.filter(user=request.user).first()
         if cart:
             cart.items.all().delete()
-            return JsonResponse({'status': 'success', 'message': 'Cart cleared successfully'})
+            refresh_cart_quantity(request.user.id)
+            return JsonResponse({'status': 'success', 'message': 'Cart cleared successfully', 'cart_quantity': 0})
         return JsonResponse({'status': 'error', 'message': 'Cart not found'})
     except Exception as e:
-        print(f"Error in clear_cart: {str(e)}")  # For debugging
+        logger.error(f"Error in clear_cart: {str(e)}")
         return JsonResponse({'status': 'error', 'message': 'An unexpected error occurred'}, status=500)
 
 
+def _cart_json(quote):
+    lines = quote.lines + quote.unavailable_lines
+    return {
+        'items': [
+            {
+                'item_id': line.item.id,
+                'quantity': line.item.quantity,
+                'original_price': float(line.original_price),
+                'discounted_price': float(line.discounted_price),
+                'subtotal': float(line.subtotal),
+                'available': line.available,
+            }
+            for line in lines
+        ],
+        'cart_quantity': sum(line.item.quantity for line in lines),
+        'subtotal': float(quote.subtotal),
+        'tax': float(quote.tax),
+        'shipping': float(quote.shipping),
+        'total': float(quote.total),
+    }
+
+
+@require_POST
+def cart_batch(request):
+    """Apply a burst of cart changes atomically and return the re-priced cart"""
+    try:
+        operations = json.loads(request.body).get('operations')
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+
+    try:
+        if request.user.is_authenticated:
+            quote = apply_cart_operations(request.user, operations)
+        else:
+            lines, quote = apply_guest_operations(load_guest_cart(request), operations)
+    except CartOperationError as e:
+        # Nothing was saved; send the current cart so the page can resync
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e),
+            'cart': _cart_json(_current_quote(request)),
+        }, status=400)
+
+    response = JsonResponse({'status': 'success', 'message': 'Cart updated', 'cart': _cart_json(quote)})
+    if not request.user.is_authenticated:
+        save_guest_cart(response, lines)
+    return response
+
+
 def order_failed(request, message):
     return render(request, 'store/order_failed.html', {'message': message})
 
@@ -969,7 +983,7 @@ def order_list(request):
 @login_required
 def order_detail(request, order_id):
     order = get_object_or_404(Order, order_id=order_id, user=request.user)
-    order_items = OrderItem.objects.filter(order=order).select_related('product', 'variant')
+    order_items = OrderItem.objects.filter(order=order).select_related('product__cover_image', 'variant')
     shipping_address = order.address
 
     context = {
@@ -981,7 +995,11 @@ def order_detail(request, order_id):
 
 @login_required
 def download_invoice(request, order_id):
-    order = get_object_or_404(Order, order_id=order_id, user=request.user)
+    order = get_object_or_404(
+        Order.objects.prefetch_related('items__product__cover_image'),
+        order_id=order_id,
+        user=request.user
+    )
     
     # Verify the order belongs to the logged-in user
     if order.user != request.user:
@@ -1003,16 +1021,13 @@ def download_invoice(request, order_id):
     return HttpResponse("Error generating PDF", status=400)
 
 
-import logging
-
-logger = logging.getLogger(__name__)
-
 @login_required
 @require_http_methods(["POST"])
+@idempotent('cancel_order')
 def cancel_order(request, order_id):
     try:
         order = get_object_or_404(Order, order_id=order_id, user=request.user)
-        if order.status in ['Delivered', 'Cancelled', 'Returned']:
+        if order.status in ['Delivered', 'Cancelled', 'Returned', 'Failed']:
             return JsonResponse({'success': False, 'message': 'This order cannot be cancelled.'})
 
         data = json.loads(request.body)
@@ -1395,94 +1410,36 @@ def send_email_update_otp(email, otp_code):
 
 ############################################################################
 @login_required
+@idempotent('place_order')
 def checkout(request):
     cart = get_object_or_404(Cart, user=request.user)
-    cart_items = cart.items.select_related('product', 'variant').prefetch_related('product__images')
-
-    valid_items = []
-    cart_data = []
-    subtotal = Decimal('0.00')
-
-    for item in cart_items:
-        if (
-            not item.product.is_blocked and
-            not item.product.is_deleted and
-            not item.product.category.is_blocked and
-            not item.product.category.is_deleted
-        ):
-            original_price = item.variant.price if item.variant else item.product.price
-            best_offer = get_best_offer_for_product(item.product)
-            discounted_price = original_price
-            if best_offer:
-                discounted_price = original_price * (
-                    Decimal('1.0') - (best_offer.discount_percentage / Decimal('100.0')))
-            cart_data.append({
-                'item': item,
-                'original_price': original_price,
-                'discounted_price': discounted_price,
-                'best_offer': best_offer,
-                'subtotal': discounted_price * Decimal(str(item.quantity))
-            })
-            subtotal += discounted_price * Decimal(str(item.quantity))
-            valid_items.append(item)
+    quote = CartPricer(cart).quote()
 
-    if len(valid_items) != len(cart_items):
-        cart.items.exclude(pk__in=[item.pk for item in valid_items]).delete()
-        cart_items = valid_items
+    # Unavailable items cannot be ordered; drop them from the cart
+    if quote.unavailable_lines:
+        cart.items.filter(pk__in=[line.item.pk for line in quote.unavailable_lines]).delete()
+        refresh_cart_quantity(request.user.id)
 
-    tax = subtotal * Decimal('0.05')
-    shipping = Decimal('0.00') if subtotal > Decimal('1000') else Decimal('50.00')
-    discount = Decimal('0.00')
+    cart_data = quote.lines
+    cart_items = quote.items
+    subtotal = quote.subtotal
     coupon_applied = False
     applied_coupon = None
     coupon_message = ''
 
-    referral = Referral.objects.filter(referred_user=request.user).first()
-    is_referred_user = bool(referral)
-    valid_referral_coupon = None
-    valid_welcome_coupon = None
-
-    if not is_referred_user:
-        valid_referral_coupon = Coupon.objects.filter(
-            referrer_rewards__referrer=request.user,
-            is_active=True,
-            valid_from__lte=timezone.now(),
-            valid_until__gte=timezone.now(),
-            minimum_order_amount__lte=subtotal
-        ).filter(
-            models.Q(usage_limit__isnull=True) | models.Q(usage_count__lt=models.F('usage_limit'))
-        ).first()
-    else:
-        valid_welcome_coupon = Coupon.objects.filter(
-            referred_rewards__referred_user=request.user,
-            is_active=True,
-            valid_from__lte=timezone.now(),
-            valid_until__gte=timezone.now(),
-            minimum_order_amount__lte=subtotal
-        ).filter(
-            models.Q(usage_limit__isnull=True) | models.Q(usage_count__lt=models.F('usage_limit'))
-        ).first()
-
-    # Get all valid coupons excluding referral coupons
-    referral_coupon_ids = list(Referral.objects.exclude(
-        referrer_coupon__isnull=True
-    ).values_list('referrer_coupon__id', flat=True)) + list(Referral.objects.exclude(
-        referred_coupon__isnull=True
-    ).values_list('referred_coupon__id', flat=True))
-
-    valid_coupons = Coupon.objects.filter(
-        is_active=True,
-        valid_from__lte=timezone.now(),
-        valid_until__gte=timezone.now(),
-        minimum_order_amount__lte=subtotal
-    ).filter(
-        models.Q(usage_limit__isnull=True) | models.Q(usage_count__lt=models.F('usage_limit'))
-    ).exclude(
-        id__in=referral_coupon_ids
-    ).order_by('-discount_value')
-
-    # Get user's wallet
-    wallet, created = Wallet.objects.get_or_create(user=request.user)
+    # Promo coupons plus the user's own referral and welcome coupons, in one query
+    eligible_coupons = {coupon.code: coupon for coupon in Coupon.eligible_for(request.user, subtotal)}
+    valid_coupons = [coupon for coupon in eligible_coupons.values() if coupon.kind == Coupon.PROMO]
+    valid_referral_coupon = next(
+        (coupon for coupon in eligible_coupons.values() if coupon.kind == Coupon.REFERRER_REWARD), None
+    )
+    valid_welcome_coupon = next(
+        (coupon for coupon in eligible_coupons.values() if coupon.kind == Coupon.WELCOME), None
+    )
+
+    # Read the balance only; a wallet row is created when money first goes in
+    wallet = Wallet.objects.filter(user=request.user).first()
+    wallet_balance = wallet.balance if wallet else Decimal('0.00')
 
     if request.method == 'POST':
         if 'submit_address_form' in request.POST:
@@ -1505,14 +1462,10 @@ def checkout(request):
         elif 'apply_coupon' in request.POST:
             coupon_code = request.POST.get('coupon_code', '').strip()
             try:
-                coupon = Coupon.objects.get(code=coupon_code)
-                if (
-                    (is_referred_user and coupon == valid_welcome_coupon) or
-                    (not is_referred_user and coupon == valid_referral_coupon) or
-                    (coupon in valid_coupons)
-                ):
+                coupon = eligible_coupons.get(coupon_code) or Coupon.objects.get(code=coupon_code)
+                if coupon.is_available_to(request.user):
                     if coupon.is_valid and subtotal >= coupon.minimum_order_amount:
-                        discount = coupon.apply_discount(subtotal)
+                        discount = quote.apply_coupon(coupon)
                         coupon_applied = True
                         applied_coupon = coupon
                         coupon_message = f"Coupon applied: {coupon.code}"
@@ -1520,12 +1473,14 @@ def checkout(request):
                             return JsonResponse({
                                 'success': True,
                                 'discount': str(discount),
-                                'total': str(subtotal + tax + shipping - discount),
+                                'total': str(quote.total),
                                 'coupon_applied': True,
                                 'message': 'Coupon applied successfully!'
                             })
                         messages.success(request, 'Coupon applied successfully!')
                         return redirect('checkout')
+                    elif coupon.is_valid:
+                        error_message = f'This coupon needs a minimum order of ₹{coupon.minimum_order_amount}.'
                     else:
                         error_message = 'Coupon is invalid or not applicable for this order.'
                 else:
@@ -1533,13 +1488,13 @@ def checkout(request):
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                     return JsonResponse({'success': False, 'message': error_message}, status=400)
                 messages.error(request, error_message)
-                return redirect('checkout')
+                return retryable(redirect('checkout'))
             except Coupon.DoesNotExist:
                 error_message = 'Invalid coupon code.'
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                     return JsonResponse({'success': False, 'message': error_message}, status=400)
                 messages.error(request, error_message)
-                return redirect('checkout')
+                return retryable(redirect('checkout'))
 
         elif 'place_order' in request.POST:
             logger = logging.getLogger(__name__)
@@ -1550,41 +1505,38 @@ def checkout(request):
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                     return JsonResponse(error_response, status=400)
                 messages.error(request, error_response['error'])
-                return redirect('checkout')
+                return retryable(redirect('checkout'))
 
             coupon_code = request.POST.get('coupon_code', '').strip()
             if coupon_code:
                 try:
-                    coupon = Coupon.objects.get(code=coupon_code)
-                    if (
-                        (is_referred_user and coupon == valid_welcome_coupon) or
-                        (not is_referred_user and coupon == valid_referral_coupon) or
-                        (coupon in valid_coupons)
-                    ):
+                    coupon = eligible_coupons.get(coupon_code) or Coupon.objects.get(code=coupon_code)
+                    if coupon.is_available_to(request.user):
                         if coupon.is_valid and subtotal >= coupon.minimum_order_amount:
-                            discount = coupon.apply_discount(subtotal)
+                            quote.apply_coupon(coupon)
                             coupon_applied = True
                             applied_coupon = coupon
-                            coupon.usage_count += 1
-                            coupon.save()
                         else:
-                            error_response = {'error': 'Coupon is invalid or not applicable.'}
+                            if coupon.is_valid:
+                                error_response = {'error': f'This coupon needs a minimum order of ₹{coupon.minimum_order_amount}.'}
+                            else:
+                                error_response = {'error': 'Coupon is invalid or not applicable.'}
                             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                                 return JsonResponse(error_response, status=400)
                             messages.error(request, error_response['error'])
-                            return redirect('checkout')
+                            return retryable(redirect('checkout'))
                     else:
                         error_response = {'error': 'This coupon is not available for your account.'}
                         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                             return JsonResponse(error_response, status=400)
                         messages.error(request, error_response['error'])
-                        return redirect('checkout')
+                        return retryable(redirect('checkout'))
                 except Coupon.DoesNotExist:
                     error_response = {'error': 'Invalid coupon code.'}
                     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                         return JsonResponse(error_response, status=400)
                     messages.error(request, error_response['error'])
-                    return redirect('checkout')
+                    return retryable(redirect('checkout'))
 
             address_id = request.POST.get('selected_address')
             if not address_id:
@@ -1592,19 +1544,19 @@ def checkout(request):
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                     return JsonResponse(error_response, status=400)
                 messages.error(request, error_response['error'])
-                return redirect('checkout')
+                return retryable(redirect('checkout'))
 
             address = get_object_or_404(Address, id=address_id, user=request.user)
             payment_method = request.POST.get('payment', 'COD')
 
             # Validate COD for orders above ₹1000
-            total_amount = subtotal + tax + shipping - discount
+            total_amount = quote.total
             if payment_method == 'COD' and total_amount > Decimal('1000'):
                 error_response = {'error': 'Cash on Delivery is not available for orders above ₹1000.'}
                 if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                     return JsonResponse(error_response, status=400)
                 messages.error(request, error_response['error'])
-                return redirect('checkout')
+                return retryable(redirect('checkout'))
 
             for item in cart_items:
                 available_stock = item.variant.stock if item.variant else item.product.stock
@@ -1615,102 +1567,95 @@ def checkout(request):
                     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                         return JsonResponse(error_response, status=400)
                     messages.error(request, error_response['error'])
-                    return redirect('checkout')
+                    return retryable(redirect('checkout'))
 
-            total_amount = subtotal + tax + shipping - discount
+            total_amount = quote.total
 
             # Handle wallet payment
             if payment_method == 'Wallet':
-                if wallet.balance < total_amount:
+                if wallet is None or wallet_balance < total_amount:
                     error_response = {'error': 'Insufficient wallet balance'}
                     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                         return JsonResponse(error_response, status=400)
                     messages.error(request, error_response['error'])
-                    return redirect('checkout')
+                    return retryable(redirect('checkout'))
 
-            with transaction.atomic():
-                order = Order.objects.create(
-                    user=request.user,
-                    address=address,
-                    total_amount=total_amount,
-                    payment_method=payment_method,
-                    coupon=applied_coupon
-                )
-
-                for item in cart_data:
-                    OrderItem.objects.create(
-                        order=order,
-                        product=item['item'].product,
-                        variant=item['item'].variant,
-                        quantity=item['item'].quantity,
-                        price=item['discounted_price']
+            # Stock, coupon uses and the wallet are taken with conditional updates;
+            # if any of them lost a race since the checks above, nothing is saved
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(
+                        user=request.user,
+                        address=address,
+                        total_amount=total_amount,
+                        payment_method=payment_method,
+                        coupon=applied_coupon,
+                        is_paid=payment_method == 'Wallet',
+                        status='Processing' if payment_method == 'Wallet' else 'Pending'
                     )
-                    if item['item'].variant:
-                        item['item'].variant.stock -= item['item'].quantity
-                        item['item'].variant.save()
-                    item['item'].product.stock -= item['item'].quantity
-                    item['item'].product.save()
-
-                if payment_method == 'Wallet':
-                    wallet.balance -= total_amount
-                    wallet.save()
-                    WalletTransaction.objects.create(
-                        wallet=wallet,
-                        order=order,
-                        transaction_type='debit',
-                        amount=total_amount,
-                        description=f'Payment for Order {order.order_id}'
+                    # The user's own checkout holds give way to the order itself
+                    release_checkout_holds(request.user)
+                    place_order_lines(order, cart_data)
+                    if payment_method not in ('COD', 'Wallet'):
+                        hold_for_payment(order, cart_data)
+                    if applied_coupon:
+                        redeem_coupon(applied_coupon)
+                    if payment_method == 'Wallet':
+                        debit_wallet(wallet, total_amount, order)
+
+                    cart.items.all().delete()
+                    refresh_cart_quantity(request.user.id)
+            except OrderPlacementError as e:
+                error_response = {'error': str(e)}
+                if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                    return JsonResponse(error_response, status=400)
+                messages.error(request, error_response['error'])
+                return retryable(redirect('checkout'))
+
+            # The payment gateway is called after commit, with no stock rows locked
+            if payment_method == 'COD' or payment_method == 'Wallet':
+                if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                    return JsonResponse({'redirect_url': reverse('order_success', args=[order.id])})
+                messages.success(request, 'Order placed successfully!')
+                return redirect('order_success', order_id=order.id)
+            else:
+                try:
+                    razorpay_order = create_razorpay_order(
+                        amount=float(order.total_amount),
+                        receipt_id=order.id
                     )
-                    order.is_paid = True
-                    order.status = 'Processing'
+                    order.razorpay_order_id = razorpay_order['id']
                     order.save()
 
-                cart.items.all().delete()
-
-                if payment_method == 'COD' or payment_method == 'Wallet':
                     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                        return JsonResponse({'redirect_url': reverse('order_success', args=[order.id])})
-                    messages.success(request, 'Order placed successfully!')
-                    return redirect('order_success', order_id=order.id)
-                else:
-                    try:
-                        razorpay_order = create_razorpay_order(
-                            amount=float(order.total_amount),
-                            receipt_id=order.id
-                        )
-                        order.razorpay_order_id = razorpay_order['id']
-                        order.save()
-
-                        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                            return JsonResponse({
-                                'razorpay': True,
-                                'redirect_url': reverse('payment_handler_init', args=[order.id]),
-                                'razorpay_options': {
-                                    'key': settings.RAZORPAY_API_KEY,
-                                    'amount': int(float(order.total_amount) * 100),
-                                    'currency': settings.RAZORPAY_CURRENCY,
-                                    'name': "Aura Scents",
-                                    'description': f"Order #{order.id}",
-                                    'order_id': razorpay_order['id'],
-                                    'handler': request.build_absolute_uri(reverse('payment_handler')),
-                                    'prefill': {
-                                        'name': request.user.get_full_name() or request.user.email.split('@')[0],
-                                        'email': request.user.email,
-                                        'contact': order.address.mobile_number or '9999999999'
-                                    },
-                                    'theme': {'color': '#7c3aed'}
-                                }
-                            })
-                        return redirect('payment_handler_init', order_id=order.id)
-                    except Exception as e:
-                        logger.error(f"Razorpay error: {str(e)}")
-                        order.status = 'Failed'
-                        order.save()
-                        error_response = {'error': f'Payment processing error: {str(e)}'}
-                        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                            return JsonResponse(error_response, status=400)
-                        messages.error(request, error_response['error'])
-                        return redirect('checkout')
+                        return JsonResponse({
+                            'razorpay': True,
+                            'redirect_url': reverse('payment_handler_init', args=[order.id]),
+                            'razorpay_options': {
+                                'key': settings.RAZORPAY_API_KEY,
+                                'amount': int(float(order.total_amount) * 100),
+                                'currency': settings.RAZORPAY_CURRENCY,
+                                'name': "Aura Scents",
+                                'description': f"Order #{order.id}",
+                                'order_id': razorpay_order['id'],
+                                'handler': request.build_absolute_uri(reverse('payment_handler')),
+                                'prefill': {
+                                    'name': request.user.get_full_name() or request.user.email.split('@')[0],
+                                    'email': request.user.email,
+                                    'contact': order.address.mobile_number or '9999999999'
+                                },
+                                'theme': {'color': '#7c3aed'}
+                            }
+                        })
+                    return redirect('payment_handler_init', order_id=order.id)
+                except Exception as e:
+                    logger.error(f"Razorpay error: {str(e)}")
+                    fail_unpaid_orders([order.id])
+                    error_response = {'error': f'Payment processing error: {str(e)}'}
+                    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                        return JsonResponse(error_response, status=400)
+                    messages.error(request, error_response['error'])
+                    return retryable(redirect('checkout'))
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest' and 'get_address_form' in request.GET:
         address_id = request.GET.get('address_id')
@@ -1719,28 +1664,31 @@ def checkout(request):
         html = render_to_string('store/includes/address_modal_form.html', {'form': form, 'title': title}, request=request)
         return JsonResponse({'html': html})
 
-    total = subtotal + tax + shipping - discount
+    if request.method == 'GET':
+        for item in hold_checkout(request.user, cart_items):
+            messages.warning(request, f"We could not hold {item.product.name} for you; it may sell out before you order.")
 
     return render(request, 'store/checkout.html', {
         'addresses': Address.objects.filter(user=request.user),
         'cart_items': cart_data,
-        'subtotal': subtotal,
-        'tax': tax,
-        'shipping': shipping,
-        'discount': discount,
-        'total': total,
+        'subtotal': quote.subtotal,
+        'tax': quote.tax,
+        'shipping': quote.shipping,
+        'discount': quote.discount,
+        'total': quote.total,
         'valid_coupons': valid_coupons,
         'coupon_applied': coupon_applied,
         'applied_coupon': applied_coupon,
         'coupon_message': coupon_message,
-        'free_shipping': shipping == Decimal('0.00'),
-        'referral': referral,
+        'free_shipping': quote.free_shipping,
         'valid_referral_coupon': valid_referral_coupon,
         'valid_welcome_coupon': valid_welcome_coupon,
-        'wallet_balance': wallet.balance,
+        'wallet_balance': wallet_balance,
+        'idempotency_key': uuid4().hex,
     })
 
 @csrf_exempt
+@idempotent('payment_handler', key_func=lambda request: request.POST.get('razorpay_payment_id'))
 def payment_handler(request):
     if request.method == 'POST':
         try:
@@ -1749,7 +1697,7 @@ def payment_handler(request):
             signature = request.POST.get('razorpay_signature', '')
 
             if not all([payment_id, razorpay_order_id, signature]):
-                return redirect('order_failed', message='Missing payment parameters')
+                return retryable(redirect('order_failed', message='Missing payment parameters'))
 
             params_dict = {
                 'razorpay_payment_id': payment_id,
@@ -1760,21 +1708,21 @@ def payment_handler(request):
             # Verify the payment signature
             client.utility.verify_payment_signature(params_dict)
 
-            # Payment was successful
-            order = Order.objects.get(razorpay_order_id=razorpay_order_id)
-            order.is_paid = True
-            order.status = 'Processing'  # Changed from 'Paid' to 'Processing'
-            order.save()
+            # Payment was successful; settle the order against its stock hold
+            with transaction.atomic():
+                order = Order.objects.select_for_update().get(razorpay_order_id=razorpay_order_id)
+                if not confirm_payment(order):
+                    return redirect('order_failed', message='Your items sold out before the payment arrived. The amount was refunded to your wallet.')
 
             return redirect('order_success', order_id=order.id)
 
         except Order.DoesNotExist:
-            return redirect('order_failed', message='Invalid Order ID')
+            return retryable(redirect('order_failed', message='Invalid Order ID'))
         except SignatureVerificationError:
-            return redirect('order_failed', message='Invalid Payment Signature')
+            return retryable(redirect('order_failed', message='Invalid Payment Signature'))
         except Exception as e:
             logger.error(f"Payment handler error: {str(e)}")
-            return redirect('order_failed', message=str(e))
+            return retryable(redirect('order_failed', message=str(e)))
 
     return redirect('checkout')
 
@@ -1813,7 +1761,7 @@ def referral_profile(request):
     user = request.user
     referrals = Referral.objects.filter(referrer=user)
     total_referrals = referrals.count()
-    coupons = Coupon.objects.filter(referrer_rewards__referrer=user)
+    coupons = Coupon.objects.filter(owner=user, kind=Coupon.REFERRER_REWARD)
     active_coupons_count = coupons.filter(is_active=True).count()  # Calculate active coupons count
     
     total_savings = sum(c.discount_value for c in coupons if c.usage_count > 0)